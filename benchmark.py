@@ -0,0 +1,415 @@
+import sys
+import os
+import atexit
+import json
+import time
+import random
+import argparse
+import tempfile
+import shutil
+import tracemalloc
+
+# --- データ層のベンチマーク ---
+# 合成した画像フォルダと統計データを使い、走査・画像選択・統計の保存/読み込み・
+# 似た画像のグループ分け・サムネイル作成の所要時間、ピークメモリ、スループットを計測する。
+#
+#   python benchmark.py --sizes 10k,100k,1m
+#
+# アプリのデータファイル (インデックス・統計・サムネイル) はすべて作業フォルダに作られる。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def parse_size(text):
+    text = text.strip().lower()
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+def format_size(n):
+    if n >= 1_000_000 and n % 1_000_000 == 0:
+        return f"{n // 1_000_000}m"
+    if n >= 1_000 and n % 1_000 == 0:
+        return f"{n // 1_000}k"
+    return str(n)
+
+# --- 合成データ ---
+TREE_VERSION = 2  # 生成する内容を変えたら上げる (作成済みのフォルダを作り直す)
+SESSION_WARMUP = 10  # メモリを計測する前に回すセッション数 (画像キャッシュが埋まるまでは延ばす)
+
+def tiny_images():
+    # 走査時のヘッダー検査を通るよう、拡張子ごとに 8x8 の画像を 1 つだけエンコードして使い回す
+    from PyQt6.QtCore import QBuffer, QByteArray, QIODevice
+    from PyQt6.QtGui import QImage, QColor
+    image = QImage(8, 8, QImage.Format.Format_RGB32)
+    image.fill(QColor("#808080"))
+    encoded = {}
+    for ext, fmt in ((".jpg", "JPG"), (".png", "PNG"), (".webp", "WEBP"), (".jpeg", "JPG")):
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        if image.save(buffer, fmt):
+            encoded[ext] = bytes(data)
+    return encoded
+
+def generate_tree(root, n, files_per_dir=200, dirs_per_dir=8):
+    # 同じ n なら毎回同じ構成になる。作成済みなら再利用する
+    marker = os.path.join(root, ".complete")
+    if os.path.exists(marker):
+        with open(marker, encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get("version") == TREE_VERSION:
+            return info
+    shutil.rmtree(root, ignore_errors=True)
+    contents = tiny_images()
+    extensions = sorted(contents)
+    dir_count = max(1, (n + files_per_dir - 1) // files_per_dir)
+    dirs = []
+    for i in range(dir_count):
+        parts = []
+        j = i
+        while True:
+            parts.append(f"d{j % dirs_per_dir}")
+            j //= dirs_per_dir
+            if j == 0:
+                break
+        dirs.append(os.path.join(root, *reversed(parts), f"leaf{i}"))
+    paths = []
+    for i in range(n):
+        d = dirs[i // files_per_dir]
+        if i % files_per_dir == 0:
+            os.makedirs(d, exist_ok=True)
+            # 画像以外のファイルも混ぜる
+            open(os.path.join(d, "notes.txt"), "w").close()
+        ext = extensions[i % len(extensions)]
+        path = os.path.join(d, f"img{i:07d}{ext}")
+        with open(path, "wb") as f:
+            f.write(contents[ext])
+        paths.append(path)
+    info = {"version": TREE_VERSION, "files": n, "dirs": dir_count}
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    return info
+
+def generate_images(root, count):
+    from PyQt6.QtGui import QImage, QColor
+    os.makedirs(root, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(root, f"photo{i:05d}.jpg")
+        if not os.path.exists(path):
+            image = QImage(1600 + (i % 7) * 64, 1200, QImage.Format.Format_RGB32)
+            image.fill(QColor((i * 37) % 256, (i * 91) % 256, (i * 53) % 256))
+            image.save(path, "JPG", 90)
+        paths.append(path)
+    return paths
+
+def synthetic_stats(paths, seed):
+    rng = random.Random(seed)
+    return {p: rng.choice((0, 0, 1, 1, 2, 3, 5)) for p in paths}
+
+# --- 計測 ---
+class Result:
+    def __init__(self, name, size, items, seconds, peak_bytes):
+        self.name = name
+        self.size = size
+        self.items = items
+        self.seconds = seconds
+        self.peak_bytes = peak_bytes
+
+    def as_dict(self):
+        return {
+            "bench": self.name,
+            "size": self.size,
+            "items": self.items,
+            "seconds": round(self.seconds, 6),
+            "peak_mb": round(self.peak_bytes / (1024 * 1024), 2),
+            "throughput": round(self.items / self.seconds, 1) if self.seconds > 0 else None,
+        }
+
+def measure(name, size, items, fn):
+    tracemalloc.start()
+    t = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - t
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return Result(name, size, items, seconds, peak)
+
+# --- 各ベンチマーク ---
+def bench_scan(app, workdir, size, root, n):
+    results = []
+    db_path = os.path.join(workdir, f"index_{format_size(size)}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    folders = [{"path": root, "checked": True}]
+    app.library_index = app.LibraryIndex(db_path)
+    found = []
+    results.append(measure("scan_cold_index", size, n, lambda: found.append(len(app.get_image_files(folders)))))
+    results.append(measure("scan_warm_index", size, n, lambda: found.append(len(app.get_image_files(folders)))))
+    results.append(measure("scan_walk", size, n, lambda: found.append(len(app.walk_image_files(root)))))
+    if len(set(found)) != 1:
+        print(f"  warning: scan results differ {found}", file=sys.stderr)
+    return results
+
+def bench_selection(app, size, paths, operations, seed):
+    results = []
+    for policy, suffix in (("min_count", ""), ("weighted", "_weighted")):
+        stats = app.ImageStatsManager(db_path=None, json_path=None)
+        stats.stats = synthetic_stats(paths, seed)
+        holder = {}
+        results.append(measure("pool_build" + suffix, size, len(paths),
+                               lambda: holder.setdefault("pool", stats.create_pool(paths, policy))))
+        pool = holder["pool"]
+        pool.rng = random.Random(seed)
+
+        def run():
+            current = None
+            for _ in range(operations):
+                current = stats.select_next_image(pool, current)
+                stats.increment_count(current)
+        results.append(measure("select_and_increment" + suffix, size, operations, run))
+    return results
+
+def bench_stats(app, workdir, size, paths, seed):
+    results = []
+    counts = synthetic_stats(paths, seed)
+    db_path = os.path.join(workdir, f"stats_{format_size(size)}.db")
+    json_path = os.path.join(workdir, f"stats_{format_size(size)}.json")
+    for path in (db_path, db_path + "-wal", db_path + "-shm", json_path, json_path + ".migrated"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(counts, f, ensure_ascii=False, indent=2)
+    holder = {}
+    results.append(measure("stats_migrate_json", size, len(counts),
+                           lambda: holder.setdefault("manager", app.ImageStatsManager(db_path, json_path))))
+    manager = holder["manager"]
+
+    def save_all():
+        manager.dirty = dict(manager.stats)
+        manager.save_stats()
+    results.append(measure("stats_save_all", size, len(counts), save_all))
+    results.append(measure("stats_load", size, len(counts), lambda: app.ImageStatsManager(db_path, None)))
+
+    rng = random.Random(seed)
+    sample = [rng.choice(paths) for _ in range(100)]
+
+    def increment_and_flush():
+        for path in sample:
+            manager.increment_count(path)
+        manager.save_stats()
+    results.append(measure("stats_increment_flush_100", size, len(sample), increment_and_flush))
+    manager.close()
+
+    # 旧形式 (JSON 全体の書き直し) との比較用
+    def legacy_json_save():
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(counts, f, ensure_ascii=False, indent=2)
+    results.append(measure("stats_legacy_json_save", size, len(counts), legacy_json_save))
+    return results
+
+def bench_cluster(app, size, seed, distance=4):
+    # 知覚ハッシュのグループ分け。1 割は既存のハッシュを数ビット変えた「似た画像」にする
+    rng = random.Random(seed)
+    unique = size - size // 10
+    hashes = [rng.getrandbits(64) for _ in range(unique)]
+    for i in range(size - unique):
+        value = hashes[rng.randrange(unique)]
+        for _ in range(rng.randrange(1, distance + 1)):
+            value ^= 1 << rng.randrange(64)
+        hashes.append(value)
+    return [measure("phash_cluster", size, size, lambda: app.cluster_hashes(hashes, distance))]
+
+def bench_thumbnails(app, workdir, images):
+    cache_dir = os.path.join(workdir, "thumb_cache_bench")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    cache = app.ThumbnailCache(cache_dir)
+    results = [measure("thumbnail_cold", len(images), len(images), lambda: [cache.load(p) for p in images])]
+    results.append(measure("thumbnail_warm", len(images), len(images), lambda: [cache.load(p) for p in images]))
+    return results
+
+def current_rss():
+    # 常駐メモリ (Linux のみ。それ以外は None)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def wait_for(qt_app, condition, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError("timed out waiting for the GUI")
+        qt_app.processEvents()
+        time.sleep(0.001)
+
+def bench_sessions(app, qt_app, photo_dir, sessions, warmup=SESSION_WARMUP, images_per_session=5):
+    # 実際の画面を通してセッション → リザルト → レビューを繰り返し、メモリが増え続けないことを確かめる。
+    # 計測の前に warmup 回 (画像キャッシュが上限近くまで埋まらなければ最大 3 倍まで) 暖機し、
+    # 計測したセッションの最初の 2 割と最後の 2 割の常駐メモリの平均を比べる (1 回ごとの値は揺れるため)
+    from PyQt6.QtCore import QEvent
+    window = app.MainWindow()
+    window.show()
+    viewer = window.viewer_screen
+    result_screen = window.result_screen
+    review = window.review_screen
+    data = {"folders": [{"path": photo_dir, "checked": True}],
+            "steps": [{"count": images_per_session, "duration": 60}]}
+    samples = []
+
+    def one_session():
+        window.go_to_viewer(data)
+        wait_for(qt_app, lambda: viewer.session_started or window.stack.currentIndex() != 1)
+        while window.stack.currentIndex() == 1:
+            viewer.image_finished()
+            qt_app.processEvents()
+        # リザルト画面のサムネイルと、レビューで数枚を開く
+        result_screen.loader.thread_pool.waitForDone()
+        qt_app.processEvents()
+        paths = result_screen.tab_paths[0]
+        if paths:
+            window.go_to_review(paths, 0)
+            for i in range(1, min(3, len(paths))):
+                review.show_index(i)
+            review.thread_pool.waitForDone()
+            qt_app.processEvents()
+            window.back_to_result()
+        window.go_to_config()
+        qt_app.sendPostedEvents(None, QEvent.Type.DeferredDelete)
+
+    warmed = 0
+    while warmed < warmup or (warmed < warmup * 3 and app.image_cache.total_bytes < app.image_cache.max_bytes * 0.9):
+        one_session()
+        warmed += 1
+
+    t = time.perf_counter()
+    for i in range(sessions):
+        one_session()
+        samples.append((current_rss(), app.image_cache.total_bytes))
+    seconds = time.perf_counter() - t
+    viewer.stop_scan()
+    window.deleteLater()
+    qt_app.sendPostedEvents(None, QEvent.Type.DeferredDelete)
+
+    result = Result(f"sessions_{sessions}", sessions, sessions * images_per_session, seconds, 0)
+    mb = 1024 * 1024
+    span = max(1, sessions // 5)
+    early = [rss for rss, _ in samples[:span]]
+    late = [rss for rss, _ in samples[-span:]]
+    growth = None
+    if sessions >= 2 and None not in early + late:
+        early_mean = sum(early) / len(early)
+        late_mean = sum(late) / len(late)
+        growth = late_mean - early_mean
+        result.peak_bytes = max(rss for rss, _ in samples)
+    cache_mb = max(c for _, c in samples) / mb
+    if growth is None:
+        print(f"  sessions: RSS not measured, image cache peak {cache_mb:.1f}MB")
+    else:
+        print(f"  sessions: RSS {early_mean / mb:.1f}MB after {warmed} warm-up sessions -> {late_mean / mb:.1f}MB at the end "
+              f"({growth / mb:+.1f}MB), image cache peak {cache_mb:.1f}MB / {app.image_cache.max_bytes / mb:.0f}MB")
+    return result, growth
+
+# --- 実行 ---
+def print_result(result):
+    d = result.as_dict()
+    throughput = f"{d['throughput']:>12,.0f}/s" if d["throughput"] is not None else " " * 14
+    print(f"  {d['bench']:<30} {format_size(d['size']):>6} {d['items']:>9,}  "
+          f"{d['seconds'] * 1000:>10.1f}ms  {d['peak_mb']:>8.2f}MB  {throughput}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scanning, selection, stats persistence and thumbnails.")
+    parser.add_argument("--sizes", default="10k", help="comma separated library sizes, e.g. 10k,100k,1m")
+    parser.add_argument("--benches", default="scan,selection,stats,cluster,thumbnails,sessions")
+    parser.add_argument("--operations", type=int, default=10000, help="selections per size")
+    parser.add_argument("--thumbnails", type=int, default=100, help="real images generated for the thumbnail and session benches")
+    parser.add_argument("--sessions", type=int, default=50, help="consecutive GUI sessions for the memory check")
+    parser.add_argument("--warmup-sessions", type=int, default=SESSION_WARMUP,
+                        help="sessions run before the memory check starts (extended until the image cache fills)")
+    parser.add_argument("--cache-mb", type=int, default=64,
+                        help="image cache budget for the session bench (small, so it fills during warm-up)")
+    parser.add_argument("--max-growth-mb", type=float, default=32.0,
+                        help="fail if resident memory grows more than this after warm-up")
+    parser.add_argument("--workdir", default=None, help="reuse generated data here (default: temporary folder)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="append results as JSON lines to this file")
+    args = parser.parse_args(argv)
+
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    benches = set(args.benches.split(","))
+    json_path = os.path.abspath(args.json) if args.json else None
+    keep = args.workdir is not None
+    workdir = os.path.abspath(args.workdir) if keep else tempfile.mkdtemp(prefix="gesture_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    # アプリのデータファイルを作業フォルダに作らせるため、import の前に移動する
+    os.chdir(workdir)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    sys.path.insert(0, SCRIPT_DIR)
+    from PyQt6.QtWidgets import QApplication
+    qt_app = QApplication.instance() or QApplication(sys.argv[:1])
+    import gesture_app as app
+
+    print(f"workdir: {workdir}")
+    print(f"  {'bench':<30} {'size':>6} {'items':>9}  {'time':>12}  {'peak':>10}  {'throughput':>14}")
+    results = []
+    status = 0
+    try:
+        for size in (sizes if benches & {"scan", "selection", "stats", "cluster"} else ()):
+            root = os.path.join(workdir, f"tree_{format_size(size)}")
+            t = time.perf_counter()
+            info = generate_tree(root, size)
+            print(f"# {format_size(size)}: {info['files']:,} files in {info['dirs']:,} folders (ready in {time.perf_counter() - t:.1f}s)")
+            paths = None
+            if benches & {"selection", "stats"}:
+                paths = app.walk_image_files(root)
+            size_results = []
+            if "scan" in benches:
+                size_results += bench_scan(app, workdir, size, root, info["files"])
+            if "selection" in benches:
+                size_results += bench_selection(app, size, paths, args.operations, args.seed)
+            if "stats" in benches:
+                size_results += bench_stats(app, workdir, size, paths, args.seed)
+            if "cluster" in benches:
+                size_results += bench_cluster(app, size, args.seed)
+            for result in size_results:
+                print_result(result)
+            results += size_results
+
+        if "thumbnails" in benches and args.thumbnails > 0:
+            images = generate_images(os.path.join(workdir, "photos"), args.thumbnails)
+            print(f"# thumbnails: {len(images)} images")
+            for result in bench_thumbnails(app, workdir, images):
+                print_result(result)
+                results.append(result)
+
+        if "sessions" in benches and args.sessions > 0 and args.thumbnails > 0:
+            photo_dir = os.path.join(workdir, "photos")
+            generate_images(photo_dir, args.thumbnails)
+            print(f"# sessions: {args.sessions} sessions over {args.thumbnails} images")
+            app.image_cache.set_limit(args.cache_mb * 1024 * 1024)
+            result, growth = bench_sessions(app, qt_app, photo_dir, args.sessions, args.warmup_sessions)
+            print_result(result)
+            results.append(result)
+            if growth is not None and growth > args.max_growth_mb * 1024 * 1024:
+                print(f"  FAIL: memory grew {growth / (1024 * 1024):.1f}MB (limit {args.max_growth_mb}MB)", file=sys.stderr)
+                status = 1
+    finally:
+        # 終了時の統計の書き出しが作業フォルダの外にファイルを作らないよう、ここで閉じておく
+        atexit.unregister(app.stats_manager.close)
+        app.stats_manager.close()
+        if json_path:
+            with open(json_path, "a", encoding="utf-8") as f:
+                for result in results:
+                    f.write(json.dumps(result.as_dict()) + "\n")
+        if not keep:
+            os.chdir(SCRIPT_DIR)
+            shutil.rmtree(workdir, ignore_errors=True)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,76 @@
+import time
+STARTUP_T0 = time.perf_counter()  # --startup-time の起点
 import sys
+import math
+import atexit
+import functools
+import hashlib
+import io
 import json
+import mmap
 import os
 import random
+import re
 import shutil
+import sqlite3
+import stat
+import threading
+import weakref
+import itertools
+import zlib
+from collections import OrderedDict, deque
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QPushButton, QListWidget, 
                              QListWidgetItem, QSpinBox, QComboBox, QFileDialog, 
-                             QScrollArea, QMessageBox, QInputDialog, QProgressBar,
-                             QGridLayout, QStackedWidget, QSizePolicy, QTabWidget,
-                             QAbstractItemView, QCheckBox, QFrame)
-from PyQt6.QtCore import Qt, QTimer, QSize, pyqtSignal
-from PyQt6.QtGui import QPixmap, QImageReader, QIcon, QPainter, QColor, QFont
+                             QScrollArea, QMessageBox, QInputDialog,
+                             QStackedWidget, QSizePolicy, QTabWidget,
+                             QAbstractItemView, QCheckBox, QFrame, QListView)
+from PyQt6.QtCore import (Qt, QTimer, QSize, QRect, QRectF, QObject, QRunnable, QThread, QThreadPool, pyqtSignal,
+                          QAbstractListModel, QModelIndex, QFileSystemWatcher, QEvent,
+                          QBuffer, QByteArray, QIODevice)
+from PyQt6.QtGui import QPixmap, QImage, QImageReader, QIcon, QPainter, QColor, QFont, QPen
+startup_times = {"imports": time.perf_counter() - STARTUP_T0}  # 起動の各段階までの秒数
 
 # --- データ保存用ファイル名 (固定) ---
 PRESET_FILE = "session_sets.json"
-STATS_FILE = "image_stats.json"
+STATS_FILE = "image_stats.json"  # 旧形式 (初回起動時に STATS_DB_FILE へ移行)
+STATS_DB_FILE = "image_stats.db"
 CONFIG_FILE = "app_config.json"
+INDEX_FILE = "library_index.db"
+THUMB_CACHE_DIR = "thumb_cache"
+BROKEN_REPORT_FILE = "broken_images.txt"  # 走査で除外した読めない画像の一覧
+PERF_LOG_FILE = "perf_log.jsonl"  # セッションごとの処理時間の集計 (1 行 1 セッション)
+
+THUMB_SIZE = 200
 
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
+ARCHIVE_EXTENSIONS = {'.zip', '.cbz'}  # 展開せずに中の画像を使うアーカイブ
+
+# --- フォルダ走査の設定 ---
+SCAN_WORKERS = 4            # 並列に走査するルートフォルダ数
+SCAN_BATCH_SIZE = 500       # 一度に UI へ送るパス数
+SCAN_EMIT_INTERVAL = 0.1    # 秒
+SCAN_START_THRESHOLD = 5    # この枚数が見つかったらセッションを開始する
+FINGERPRINT_CHUNK = 16 * 1024  # 指紋のために先頭・中央・末尾から読むバイト数
+ARCHIVE_PROBE_BYTES = 256 * 1024  # アーカイブ内の画像を検査するときに展開する先頭のバイト数
+ARCHIVE_MAX_OPEN = 16       # メモリマップしたままにするアーカイブ数
+
+# --- フォルダ監視の設定 ---
+WATCH_SETTLE_MS = 500       # 変更通知が止まってからこれだけ待ってまとめて反映する
+WATCH_MAX_DELAY_MS = 3000   # 通知が続いていてもこれ以上は待たない
+WATCH_MAX_DIRS = 8192       # 監視するフォルダ数の上限 (OS の監視数の上限対策)
+
+# --- 似た画像の判定の設定 ---
+PHASH_MASK = (1 << 64) - 1
+PHASH_WORKERS = 2           # 知覚ハッシュを計算するスレッド数
+PHASH_BATCH_SIZE = 200      # インデックスへまとめて書き込む件数
+PHASH_MAX_RUN = 256         # 同じバンド値を持つハッシュをこれ以上先までは比べない
+PHASH_MIN_DETAIL = 4        # 立っている (または落ちている) ビットがこれ以下のハッシュは比べない
+
+# --- タイマーの設定 ---
+BEEP_SECONDS = [3, 2, 1]    # 残り秒数がこれを切ったらビープ
+TICK_MIN_INTERVAL = 0.1     # 秒。バーの更新はこれより細かくしない
+TICK_MAX_INTERVAL = 1.0     # 秒
 
 # --- 言語リソース ---
 TEXTS = {
@@ -53,6 +106,7 @@ TEXTS = {
     "btn_move": {"en": "Move Image", "ja": "画像を別フォルダに移動"}, # Changed
     "btn_stop": {"en": "Quit (Esc)", "ja": "終了 (Esc)"},
     "loading": {"en": "Loading...", "ja": "読み込み中..."},
+    "scanning": {"en": "Scanning folders... {} images found", "ja": "フォルダを走査中... {} 枚見つかりました"},
     
     # Status Display (New Format)
     # {0}=Time, {1}=Current, {2}=Total
@@ -61,12 +115,14 @@ TEXTS = {
     
     "next_fmt": {"en": "Next: [ {}s x {} ]", "ja": "次: [ {}秒 x {} ]"},
     "next_finish": {"en": "Next: Finish", "ja": "次: 終了"},
+    "next_image": {"en": "  ▶ {}", "ja": "  ▶ {}"},
     
     "tab_completed": {"en": "Completed", "ja": "完了した画像"},
     "tab_skipped": {"en": "Skipped", "ja": "スキップした画像"},
     "result_msg": {"en": "<b>Session Complete!</b>", "ja": "<b>セッション終了！</b>"},
     "result_stats": {"en": "Finished: {} | Skipped: {}", "ja": "完了: {} 枚 | スキップ: {} 枚"},
     "result_hint": {"en": "Click thumbnail to review.", "ja": "サムネイルをクリックで拡大表示"},
+    "review_pos": {"en": "{} / {}   ← → : Prev / Next   Click / Esc: Back", "ja": "{} / {}   ← → : 前へ / 次へ   クリック / Esc: 一覧に戻る"},
     "btn_back_config": {"en": "Back to Config", "ja": "設定画面に戻る"},
     "tt_lang": {"en": "Switch to Japanese", "ja": "英語に切り替え"},
     "msg_error": {"en": "Error", "ja": "エラー"},
@@ -77,92 +133,2499 @@ TEXTS = {
     "msg_moved": {"en": "Image moved to:\n{}", "ja": "画像を移動しました:\n{}"},
     "msg_move_fail": {"en": "Failed to move image.", "ja": "画像の移動に失敗しました。"},
     "select_move_target": {"en": "Select destination folder", "ja": "移動先のフォルダを選択してください"},
+    "move_failed": {"en": "Could not move {}: {}", "ja": "{} を移動できませんでした: {}"},
+    "btn_undo_move": {"en": "Undo Move ({})", "ja": "移動を元に戻す ({})"},
+    "move_archive": {"en": "Images inside ZIP/CBZ archives cannot be moved", "ja": "ZIP/CBZ アーカイブ内の画像は移動できません"},
+    "broken_skipped": {"en": "{} unreadable files skipped (see {})", "ja": "読めないファイル {} 件を除外しました ({} を参照)"},
+    "flag_pinned": {"en": "📌 Pinned (shown more often)", "ja": "📌 ピン留めしました (表示されやすくなります)"},
+    "flag_unpinned": {"en": "Unpinned", "ja": "ピン留めを解除しました"},
+    "flag_banned": {"en": "🚫 Excluded from future sessions", "ja": "🚫 今後のセッションで表示しません"},
+    "flag_unbanned": {"en": "Exclusion removed", "ja": "除外を解除しました"},
+    "review_flags": {"en": "   P: Pin   B: Exclude", "ja": "   P: ピン留め   B: 除外"},
+    "review_load_failed": {"en": "Cannot load {}", "ja": "{} を読み込めません"},
+    "perf_title": {"en": "Timing (ms)   count  p50  p95  max   [F3]", "ja": "処理時間 (ms)   回数  p50  p95  最大   [F3]"},
 }
 
-# --- 統計管理クラス ---
-class ImageStatsManager:
-    def __init__(self):
-        self.stats = {}
-        self.load_stats()
+# --- 処理時間の計測 ---
+# 主要な処理の所要時間を 2 のべき乗 (マイクロ秒) のバケットで集計する。
+# 1 回あたりのコストは perf_counter 2 回とロック 1 回だけなので常に有効にしておく
+class PerfHistogram:
+    BUCKETS = 32  # 1us .. 約 36 分
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = min(self.BUCKETS - 1, int(seconds * 1_000_000).bit_length())
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        # バケットの上端を返すので最大 2 倍の誤差がある
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.max, (1 << bucket) / 1_000_000)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p95_ms": round(self.percentile(0.95) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "buckets": {f"<{1 << i}us": n for i, n in enumerate(self.counts) if n},
+        }
+
+class PerfRecorder:
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = PerfHistogram()
+            histogram.add(seconds)
+
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                t = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - t)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {name: h.summary() for name, h in sorted(self.histograms.items())}
+
+    def summary_lines(self):
+        lines = []
+        for name, s in self.snapshot().items():
+            lines.append(f"{name:<22}{s['count']:>6}{s['p50_ms']:>8.1f}{s['p95_ms']:>8.1f}{s['max_ms']:>8.1f}")
+        return lines
+
+    def dump(self, path=PERF_LOG_FILE, **extra):
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), **extra, "timings": self.snapshot()}
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+perf = PerfRecorder()
+
+# --- 統計管理クラス ---
+# 表示回数は SQLite (WAL) に保存する。increment_count はメモリ上の値を更新するだけで、
+# 書き込みは FLUSH_DELAY 秒ごとにまとめてバックグラウンドスレッドで行う。
+# 回数は画像の内容の指紋 (fingerprint_file) をキーにするので、名前の変更や移動をしても引き継がれる。
+# 指紋がまだわからない画像はパスをキーにし、わかった時点で指紋のキーへ合算する。
+# 見た目がほぼ同じ画像のグループ (set_clusters) は、プールの中では回数を合計した 1 枚として扱う
+class ImageStatsManager:
+    SCHEMA_VERSION = 3
+    FLUSH_DELAY = 2.0  # 秒
+    PINNED = 1
+    BANNED = -1
+
+    def __init__(self, db_path=STATS_DB_FILE, json_path=STATS_FILE, clock=time.time, lazy=False):
+        self.db_path = db_path
+        self.json_path = json_path
+        self.clock = clock
+        self.stats = {}       # キー -> 表示回数
+        self.last_shown = {}  # キー -> 最後に表示した時刻 (UNIX 時間)
+        self.flags = {}       # キー -> PINNED / BANNED
+        self.keys = {}        # パス -> 指紋
+        self.groups = {}      # 指紋 -> グループのキー
+        self.group_members = {}  # グループのキー -> [指紋, ...]
+        self.dirty = {}       # 書き込むキー (値が None なら削除)
+        self.dirty_paths = {} # パス -> 指紋
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.flush_timer = None
+        self.pools = weakref.WeakSet()
+        # lazy のときは読み込みを ensure_loaded / load_in_background まで遅らせる (起動を速くするため)
+        self.load_lock = threading.Lock()
+        self.loaded = False
+        if not lazy:
+            self.ensure_loaded()
+
+    def ensure_loaded(self):
+        # まだなら今ここで読み込む。バックグラウンドで読み込み中なら終わるまで待つ
+        if self.loaded:
+            return
+        with self.load_lock:
+            if not self.loaded:
+                self.load_stats()
+                self.loaded = True
+
+    def load_in_background(self):
+        if not self.loaded:
+            threading.Thread(target=self.ensure_loaded, daemon=True).start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def init_db(self, conn):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        with conn:
+            if version < 1:
+                conn.execute("CREATE TABLE IF NOT EXISTS stats (path TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            if version < 2:
+                # 既存の行はパスがそのままキーになる
+                conn.execute("ALTER TABLE stats RENAME COLUMN path TO key")
+                conn.execute("CREATE TABLE IF NOT EXISTS paths (path TEXT PRIMARY KEY, key TEXT NOT NULL)")
+            if version < 3:
+                conn.execute("ALTER TABLE stats ADD COLUMN last_shown REAL")
+                conn.execute("ALTER TABLE stats ADD COLUMN flag INTEGER NOT NULL DEFAULT 0")
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def load_stats(self):
+        if self.db_path is None:
+            # 保存しない (シミュレーション用)
+            return
+        try:
+            conn = self.connect()
+        except sqlite3.Error as e:
+            print(f"Could not open {self.db_path}: {e}", file=sys.stderr)
+            return
+        try:
+            self.init_db(conn)
+            self.migrate_json(conn)
+            stats, last_shown, flags = {}, {}, {}
+            for key, count, shown, flag in conn.execute("SELECT key, count, last_shown, flag FROM stats"):
+                stats[key] = count
+                if shown is not None:
+                    last_shown[key] = shown
+                if flag:
+                    flags[key] = flag
+            self.stats, self.last_shown, self.flags = stats, last_shown, flags
+            self.keys = dict(conn.execute("SELECT path, key FROM paths"))
+        except sqlite3.Error as e:
+            # 壊れていても上書きはしない (カウントを 0 に戻さない)
+            print(f"Could not read {self.db_path}: {e}", file=sys.stderr)
+        finally:
+            conn.close()
+
+    def migrate_json(self, conn):
+        # 旧 image_stats.json からの一回限りの移行
+        if not self.json_path or not os.path.exists(self.json_path):
+            return
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        try:
+            with open(self.json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not migrate {self.json_path}: {e}", file=sys.stderr)
+            return
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO stats (key, count) VALUES (?, ?)",
+                             [(path, int(count)) for path, count in data.items()])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (self.json_path,))
+        try:
+            os.replace(self.json_path, self.json_path + ".migrated")
+        except OSError:
+            pass
+
+    def schedule_flush(self):
+        if self.db_path is None:
+            return
+        with self.lock:
+            if self.flush_timer is not None:
+                return
+            self.flush_timer = threading.Timer(self.FLUSH_DELAY, self.save_stats)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    @perf.timed("save_stats")
+    def save_stats(self):
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            batch, self.dirty = self.dirty, {}
+            path_batch, self.dirty_paths = self.dirty_paths, {}
+            rows = [(k, self.stats.get(k, 0), self.last_shown.get(k), self.flags.get(k, 0))
+                    for k, v in batch.items() if v is not None]
+        if not (batch or path_batch) or self.db_path is None:
+            return
+        with self.write_lock:
+            try:
+                conn = self.connect()
+                try:
+                    with conn:
+                        conn.executemany("INSERT OR REPLACE INTO stats (key, count, last_shown, flag) VALUES (?, ?, ?, ?)", rows)
+                        conn.executemany("DELETE FROM stats WHERE key = ?",
+                                         [(k,) for k, v in batch.items() if v is None])
+                        conn.executemany("INSERT OR REPLACE INTO paths (path, key) VALUES (?, ?)", path_batch.items())
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"Could not save stats: {e}", file=sys.stderr)
+                # 次回のフラッシュで再試行する
+                with self.lock:
+                    for key, value in batch.items():
+                        self.dirty.setdefault(key, value)
+                    for path, key in path_batch.items():
+                        self.dirty_paths.setdefault(path, key)
+
+    def close(self):
+        with self.load_lock:
+            # 読み込んでいなければ書くものもない (読み込み中なら終わるのを待つ)
+            if not self.loaded:
+                return
+        self.save_stats()
+        if self.db_path is None:
+            return
+        # WAL をデータベース本体に書き戻して切り詰める
+        with self.write_lock:
+            try:
+                conn = self.connect()
+                try:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                pass
+
+    def key_for(self, path):
+        return self.keys.get(path, path)
+
+    def group_for(self, key):
+        return self.groups.get(key, key)
+
+    def pool_key(self, path):
+        return self.group_for(self.key_for(path))
+
+    def count_of(self, key):
+        members = self.group_members.get(key)
+        if members is not None:
+            return sum(self.stats.get(k, 0) for k in members)
+        return self.stats.get(key, 0)
+
+    def last_shown_of(self, key):
+        members = self.group_members.get(key, (key,))
+        return max((self.last_shown.get(k, 0.0) for k in members), default=0.0)
+
+    def flag_of(self, key):
+        # グループは 1 枚でもピン留めならピン留め、全部が除外なら除外
+        flags = [self.flags.get(k, 0) for k in self.group_members.get(key, (key,))]
+        if self.PINNED in flags:
+            return self.PINNED
+        if all(f == self.BANNED for f in flags):
+            return self.BANNED
+        return 0
+
+    def is_allowed(self, key):
+        return self.flag_of(key) != self.BANNED
+
+    def weight_of(self, key, weights):
+        # 表示回数が少なく、最後に表示してから時間が経っている画像ほど重くする
+        weight = 1.0 / (1 + self.count_of(key)) ** weights.get("count", 1.0)
+        shown = self.last_shown_of(key)
+        half_life = weights.get("recency_days", 7.0) * 86400
+        if shown and half_life > 0:
+            age = max(0.0, self.clock() - shown)
+            weight *= max(0.01, 1.0 - 0.5 ** (age / half_life))
+        if self.flag_of(key) == self.PINNED:
+            weight *= weights.get("pin", 4.0)
+        return weight
+
+    def get_count(self, path):
+        return self.stats.get(self.key_for(path), 0)
+
+    @perf.timed("increment_count")
+    def increment_count(self, path):
+        self.ensure_loaded()
+        key = self.key_for(path)
+        self.stats[key] = self.stats.get(key, 0) + 1
+        self.last_shown[key] = self.clock()
+        if self.db_path is not None:
+            with self.lock:
+                self.dirty[key] = True
+                if key != path:
+                    self.dirty_paths[path] = key
+            self.schedule_flush()
+        for pool in list(self.pools):
+            pool.promote(self.group_for(key))
+
+    def set_identities(self, pairs):
+        # (パス, 指紋) の組を受け取り、パスをキーにしていた回数を指紋のキーへ移す
+        self.ensure_loaded()
+        changed = []
+        persist = self.db_path is not None
+        with self.lock:
+            for path, key in pairs:
+                old_key = self.keys.get(path, path)
+                if old_key == key:
+                    continue
+                self.keys[path] = key
+                changed.append((path, key))
+                if old_key == path and path in self.stats:
+                    self.stats[key] = self.stats.get(key, 0) + self.stats.pop(path)
+                    shown = self.last_shown.pop(path, None)
+                    if shown is not None:
+                        self.last_shown[key] = max(shown, self.last_shown.get(key, 0.0))
+                    flag = self.flags.pop(path, 0)
+                    if flag and not self.flags.get(key):
+                        self.flags[key] = flag
+                    if persist:
+                        self.dirty[key] = True
+                        self.dirty[path] = None
+                        self.dirty_paths[path] = key
+                elif old_key != path and persist:
+                    # 内容が差し替えられたファイル
+                    self.dirty_paths[path] = key
+        if not changed:
+            return
+        if self.dirty or self.dirty_paths:
+            self.schedule_flush()
+        for pool in list(self.pools):
+            for path, key in changed:
+                pool.rekey(path, self.group_for(key))
+
+    def set_clusters(self, clusters):
+        # clusters: [[パス, ...], ...]。指紋が 2 種類以上あるものだけをグループにする
+        self.ensure_loaded()
+        self.groups = {}
+        self.group_members = {}
+        for paths in clusters:
+            keys = sorted({self.key_for(p) for p in paths})
+            if len(keys) < 2:
+                continue
+            group = "~" + keys[0]
+            self.group_members[group] = keys
+            for key in keys:
+                self.groups[key] = group
+        for pool in list(self.pools):
+            for path, old_key in list(pool.key_of.items()):
+                new_key = self.pool_key(path)
+                if new_key != old_key:
+                    pool.rekey(path, new_key)
+
+    def rename_path(self, src, dst):
+        self.ensure_loaded()
+        key = self.keys.get(src)
+        if key is None:
+            return
+        with self.lock:
+            self.keys[dst] = key
+            if self.db_path is not None:
+                self.dirty_paths[dst] = key
+        self.schedule_flush()
+
+    def set_flag(self, path, flag):
+        # ピン留め / 除外 (0 で解除)。似た画像のグループ全体に付け、除外した画像は開いているプールからすぐに外す
+        self.ensure_loaded()
+        key = self.key_for(path)
+        group = self.group_for(key)
+        for k in self.group_members.get(group, (key,)):
+            if flag:
+                self.flags[k] = flag
+            else:
+                self.flags.pop(k, None)
+            if self.db_path is not None:
+                with self.lock:
+                    self.dirty[k] = True
+        if self.db_path is not None:
+            if key != path:
+                with self.lock:
+                    self.dirty_paths[path] = key
+            self.schedule_flush()
+        for pool in list(self.pools):
+            if self.is_allowed(group):
+                pool.reposition(group)
+            else:
+                pool.remove_key(group)
+
+    def create_pool(self, paths=(), policy="min_count", weights=None):
+        if policy == "weighted":
+            weights = dict(weights or {})
+            pool = WeightedPool(lambda key: self.weight_of(key, weights), paths, key_func=self.pool_key,
+                                accept_func=self.is_allowed)
+        else:
+            pool = ImagePool(self.count_of, paths, key_func=self.pool_key, accept_func=self.is_allowed)
+        self.pools.add(pool)
+        return pool
+
+    def select_next_image(self, image_pool, current_image_path=None, exclude=()):
+        return image_pool.pick(current_image_path, exclude)
+
+# --- 画像プール ---
+# 表示回数ごとのバケットに分けて持ち、最少回数のバケットから O(1) でランダムに選ぶ。
+# バケットには画像の識別キー (内容の指紋、未計算ならパス) を入れ、
+# 同じ内容のファイルが複数あっても 1 枚の画像として扱う
+class ImagePool:
+    def __init__(self, count_func, paths=(), rng=random, key_func=None, accept_func=None):
+        self.count_func = count_func  # キー -> 表示回数
+        self.key_func = key_func or (lambda path: path)
+        self.accept_func = accept_func  # False を返すキー (除外した画像) は入れない
+        self.rng = rng
+        self.buckets = {}     # 表示回数 -> [キー, ...]
+        self.positions = {}   # キー -> (表示回数, バケット内の位置)
+        self.members = {}     # キー -> [パス, ...] (先頭を表示に使う)
+        self.key_of = {}      # パス -> キー
+        self.parked = set()   # このセッションで表示したか予定表に入れたキー (選ばれないようバケットから外してある)
+        self.discards = 0     # 取り除いた回数 (予定表を見直す必要があるかの判定用)
+        self.min_count = None # None のときは次の pick で再計算する
+        self.extend(paths)
+
+    def __len__(self):
+        return len(self.positions) + len(self.parked)
+
+    def __contains__(self, path):
+        return path in self.key_of
+
+    def __iter__(self):
+        return iter([self.members[key][0] for key in itertools.chain(self.positions, self.parked)])
+
+    def paths(self):
+        return list(self.key_of)
+
+    def add(self, path, key=None):
+        if path in self.key_of:
+            return
+        if key is None:
+            key = self.key_func(path)
+        if self.accept_func is not None and not self.accept_func(key):
+            return
+        self.key_of[path] = key
+        members = self.members.get(key)
+        if members is not None:
+            # 同じ内容の画像がすでにある
+            members.append(path)
+            return
+        self.members[key] = [path]
+        self.insert(key, self.count_func(key))
+
+    def extend(self, paths):
+        for path in paths:
+            self.add(path)
+
+    def insert(self, key, count):
+        bucket = self.buckets.setdefault(count, [])
+        self.positions[key] = (count, len(bucket))
+        bucket.append(key)
+        if self.min_count is not None and count < self.min_count:
+            self.min_count = count
+        elif self.min_count is None and len(self.positions) == 1:
+            self.min_count = count
+
+    def detach(self, key):
+        # 末尾の要素と入れ替えて取り除く
+        count, index = self.positions.pop(key)
+        bucket = self.buckets[count]
+        last = bucket.pop()
+        if index < len(bucket):
+            bucket[index] = last
+            self.positions[last] = (count, index)
+        if not bucket:
+            del self.buckets[count]
+            if count == self.min_count:
+                self.min_count = None
+        return count
+
+    def discard(self, path):
+        key = self.key_of.pop(path, None)
+        if key is None:
+            return
+        self.discards += 1
+        members = self.members[key]
+        members.remove(path)
+        if not members:
+            del self.members[key]
+            if key in self.parked:
+                self.parked.discard(key)
+            else:
+                self.detach(key)
+
+    def remove_key(self, key):
+        for path in list(self.members.get(key, ())):
+            self.discard(path)
+
+    def rekey(self, path, key):
+        # 指紋がわかった (または変わった) パスを付け替える
+        if self.key_of.get(path, key) == key:
+            return
+        parked = self.key_of.get(path) in self.parked
+        self.discard(path)
+        self.add(path, key)
+        if parked:
+            self.park(path)
+        else:
+            self.reposition(key)
+
+    def park(self, path):
+        # 表示した (または予定表に入れた) 画像を、一巡するかセッションが終わるまで選ばれないようにする。
+        # 選ぶときにそれらを除外しなくてよいので、選択の手間が表示した枚数や予定表の長さに比例しない
+        key = self.key_of.get(path)
+        if key is None or key not in self.positions:
+            return
+        self.detach(key)
+        self.parked.add(key)
+
+    def unpark_all(self, keep=()):
+        # 表示中に変わった表示回数 (重み) で入れ直す。keep のパスは外したままにする
+        kept = {self.key_of.get(path) for path in keep}
+        parked, self.parked = self.parked, kept & self.parked
+        for key in parked - kept:
+            if key in self.members:
+                self.insert(key, self.count_func(key))
+
+    def reposition(self, key):
+        # 表示回数が外から変わったキーを正しいバケットへ移す
+        position = self.positions.get(key)
+        if position is None:
+            return
+        count = self.count_func(key)
+        if count != position[0]:
+            self.detach(key)
+            self.insert(key, count)
+
+    def promote(self, key):
+        if key not in self.positions:
+            return
+        count = self.positions[key][0]
+        emptied_min = count == self.min_count and len(self.buckets[count]) == 1
+        self.detach(key)
+        if emptied_min:
+            # 最少バケットが空になった場合、次の最少は必ず count + 1
+            self.min_count = count + 1
+        self.insert(key, count + 1)
+
+    def pick(self, current=None, exclude=()):
+        if not self.positions:
+            return None
+        if self.min_count is None:
+            self.min_count = min(self.buckets)
+        if exclude:
+            return self.pick_excluding(current, exclude)
+        bucket = self.buckets[self.min_count]
+        position = self.positions.get(self.key_of.get(current))
+        if len(bucket) > 1 and position is not None and position[0] == self.min_count:
+            # 直前の画像を避ける
+            i = self.rng.randrange(len(bucket) - 1)
+            if i >= position[1]:
+                i += 1
+            return self.members[bucket[i]][0]
+        return self.members[self.rng.choice(bucket)][0]
+
+    def pick_excluding(self, current, exclude):
+        # 先読み予約済みの画像を除いて選ぶ。除外数は少ないので数回の試行でほぼ決まる
+        excluded = {self.key_of.get(p, p) for p in exclude}
+        current_key = self.key_of.get(current)
+        avoid = excluded | {current_key}
+        for count in sorted(self.buckets):
+            bucket = self.buckets[count]
+            for _ in range(min(len(bucket), 8)):
+                key = self.rng.choice(bucket)
+                if key not in avoid:
+                    return self.members[key][0]
+            candidates = [k for k in bucket if k not in avoid]
+            if candidates:
+                return self.members[self.rng.choice(candidates)][0]
+        # 残りが直前の画像だけなら、それを繰り返す
+        if current_key is not None and current_key not in excluded:
+            return current
+        return None
+
+    def draw(self, n, current=None, exclude=()):
+        # 重複なしで n 枚を選ぶ (セッションの予定表用)。表示回数の少ないバケットから順に、
+        # 除外数 + 必要数だけ無作為に取り出せば必要数は必ずそろう
+        avoid = {self.key_of.get(p, p) for p in exclude}
+        avoid.add(self.key_of.get(current))
+        result = []
+        for count in sorted(self.buckets):
+            need = n - len(result)
+            if need <= 0:
+                break
+            bucket = self.buckets[count]
+            for key in self.rng.sample(bucket, min(len(bucket), need + len(avoid))):
+                if key not in avoid:
+                    result.append(self.members[key][0])
+                    if len(result) >= n:
+                        break
+        return result
+
+# --- 重み付きの画像プール ---
+# 各画像の重み (ImageStatsManager.weight_of) に比例して選ぶ。重みは Fenwick 木で持つので
+# 追加・削除・重みの更新・抽選がすべて O(log N)
+class WeightedPool(ImagePool):
+    REBUILD_INTERVAL = 100000  # 浮動小数点の誤差がたまらないよう、この回数の更新ごとに木を作り直す
+
+    def __init__(self, weight_func, paths=(), rng=random, key_func=None, accept_func=None):
+        self.tree = [0.0]      # 1 始まりの Fenwick 木
+        self.weights = []      # スロット -> 重み
+        self.slot_keys = []    # スロット -> キー (空きは None)
+        self.free_slots = []
+        self.total = 0.0
+        self.updates = 0
+        super().__init__(weight_func, paths, rng, key_func, accept_func)
+
+    def prefix(self, i):
+        # 先頭 i スロットの重みの合計
+        total = 0.0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def add_weight(self, slot, delta):
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def rebuild(self):
+        n = len(self.weights)
+        self.tree = [0.0] + self.weights
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                self.tree[j] += self.tree[i]
+        self.total = sum(self.weights)
+        self.updates = 0
+
+    def set_weight(self, slot, weight):
+        delta = weight - self.weights[slot]
+        if not delta:
+            return
+        self.weights[slot] = weight
+        self.add_weight(slot, delta)
+        self.total += delta
+        self.updates += 1
+        if self.updates >= self.REBUILD_INTERVAL:
+            self.rebuild()
+
+    def insert(self, key, weight):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.slot_keys[slot] = key
+        else:
+            # 末尾に足す。新しいノードは自分より前の担当範囲の合計を持つ
+            slot = len(self.weights)
+            i = slot + 1
+            self.weights.append(0.0)
+            self.slot_keys.append(key)
+            self.tree.append(self.prefix(i - 1) - self.prefix(i - (i & -i)))
+        self.positions[key] = slot
+        self.set_weight(slot, weight)
+
+    def detach(self, key):
+        slot = self.positions.pop(key)
+        self.set_weight(slot, 0.0)
+        self.slot_keys[slot] = None
+        self.free_slots.append(slot)
+
+    def reposition(self, key):
+        slot = self.positions.get(key)
+        if slot is not None:
+            self.set_weight(slot, self.count_func(key))
+
+    def promote(self, key):
+        self.reposition(key)
+
+    def sample(self):
+        n = len(self.weights)
+        for attempt in range(2):
+            remaining = self.rng.random() * self.total
+            pos = 0
+            step = 1 << n.bit_length()
+            while step:
+                if pos + step <= n and self.tree[pos + step] <= remaining:
+                    pos += step
+                    remaining -= self.tree[pos]
+                step >>= 1
+            if pos < n and self.weights[pos] > 0:
+                return self.slot_keys[pos]
+            # 丸め誤差で重み 0 のスロットに当たった
+            self.rebuild()
+        candidates = [slot for slot in range(n) if self.weights[slot] > 0]
+        return self.slot_keys[self.rng.choice(candidates)] if candidates else None
+
+    def pick(self, current=None, exclude=()):
+        if not self.positions:
+            return None
+        picked = self.draw(1, current, exclude)
+        if picked:
+            return picked[0]
+        # 残りが直前の画像だけなら、それを繰り返す
+        current_key = self.key_of.get(current)
+        if current_key is not None and current_key not in {self.key_of.get(p, p) for p in exclude}:
+            return current
+        return None
+
+    def draw(self, n, current=None, exclude=()):
+        # 除外するキーと選んだキーの重みを一時的に 0 にして、重複なしで n 回抽選する
+        avoid = {self.key_of.get(p, p) for p in exclude}
+        avoid.add(self.key_of.get(current))
+        saved = []
+        for key in avoid:
+            slot = self.positions.get(key)
+            if slot is not None and self.weights[slot] > 0:
+                saved.append((slot, self.weights[slot]))
+                self.set_weight(slot, 0.0)
+        result = []
+        try:
+            while len(result) < n and self.total > 1e-12:
+                key = self.sample()
+                if key is None:
+                    break
+                result.append(self.members[key][0])
+                slot = self.positions[key]
+                saved.append((slot, self.weights[slot]))
+                self.set_weight(slot, 0.0)
+        finally:
+            for slot, weight in saved:
+                self.set_weight(slot, weight)
+        return result
+
+    def pick_excluding(self, current, exclude):
+        return self.pick(current, exclude)
+
+# 起動時は読み込まず、最初の描画の後にバックグラウンドで読み込む (MainWindow.on_first_paint)
+stats_manager = ImageStatsManager(lazy=True)
+atexit.register(stats_manager.close)
+
+# --- セッション進行 (GUI 非依存) ---
+# ステップの進行・無限モード・スキップ・移動・履歴と残り時間を管理する。
+# 枚数の決まったステップの画像は予定表 (upcoming) として先にまとめて選び、セッション中は同じ画像を繰り返さない。
+# clock と乱数の seed を差し替えられるので、GUI なしでシミュレーションや計測ができる
+class SessionEngine:
+    def __init__(self, steps, image_pool, stats=None, clock=time.monotonic, seed=None):
+        self.steps = steps
+        self.pool = image_pool
+        self.stats = stats if stats is not None else stats_manager
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.pool.rng = self.rng
+        self.history = []
+        self.skipped = []
+        self.step_index = 0
+        self.done_in_step = 0
+        self.current = None
+        self.on_screen = False  # 表示中の画像がまだ完了もスキップもされていない (残りの枚数に入っている)
+        self.upcoming = []  # これから表示する画像の予定表 (キーはプールの中で外してある)
+        self.plan_discards = None  # 予定表を見直したときの pool.discards
+        # 時計
+        self.duration = 0.0
+        self.deadline = 0.0
+        self.stopped_remaining = None  # 止まっている間の残り秒数
+
+    @property
+    def step(self):
+        return self.steps[self.step_index] if self.step_index < len(self.steps) else None
+
+    @property
+    def next_step(self):
+        index = self.step_index + 1
+        return self.steps[index] if index < len(self.steps) else None
+
+    def is_finished(self):
+        return self.step_index >= len(self.steps)
+
+    def remaining_images(self):
+        # 無限モードのステップまでに、あと何枚表示するか
+        total = -self.done_in_step
+        for step in self.steps[self.step_index:]:
+            if step['count'] <= 0:
+                break
+            total += step['count']
+        return max(0, total)
+
+    def plan_size(self, depth):
+        # 予定表に入れておく枚数。表示中の画像は除き、無限モードのステップが続くなら少なくとも depth 枚
+        remaining = self.remaining_images() - (1 if self.on_screen else 0)
+        if any(step['count'] <= 0 for step in self.steps[self.step_index:]):
+            return max(depth, remaining)
+        return max(0, remaining)
+
+    # --- 画像の選択 ---
+    def fill_upcoming(self, depth, complete=True):
+        # 消えた画像と、後から同じ画像とわかったものを予定表から落とし、足りない分だけ選び足す。
+        # complete のときは残りの枚数分すべてを選んでおく (走査中は depth 枚だけ)。
+        # 予定表の見直しはプールから画像が取り除かれたときだけ行う
+        if self.plan_discards != self.pool.discards:
+            keys = set()
+            upcoming = []
+            for path in self.upcoming:
+                key = self.pool.key_of.get(path)
+                if key is not None and key not in keys:
+                    keys.add(key)
+                    upcoming.append(path)
+            self.upcoming = upcoming
+            self.plan_discards = self.pool.discards
+        upcoming = self.upcoming
+        target = self.plan_size(depth)
+        if not complete:
+            target = min(depth, target)
+        if len(upcoming) >= target:
+            return upcoming
+        # 表示した画像も予定表の画像もプールの中で外してあるので (ImagePool.park)、
+        # 選び足す手間は足りない枚数だけで決まる
+        upcoming += self.reserve(target - len(upcoming))
+        if len(upcoming) < target and len(self.pool.parked) > len(upcoming):
+            # 全部の画像を一巡したので、予定表の分を残して次の周回に入る
+            self.pool.unpark_all(keep=upcoming)
+            upcoming += self.reserve(target - len(upcoming))
+        if not upcoming:
+            # 残りが直前の画像だけなら繰り返す
+            path = self.stats.select_next_image(self.pool, self.current)
+            if path is not None:
+                upcoming.append(path)
+        return upcoming
+
+    def reserve(self, n):
+        drawn = self.pool.draw(n, self.current)
+        for path in drawn:
+            self.pool.park(path)
+        return drawn
+
+    def take_next(self):
+        self.fill_upcoming(1, complete=False)
+        return self.upcoming.pop(0) if self.upcoming else None
+
+    def reject(self, path):
+        # 読み込めなかった画像をプールから外す
+        self.pool.discard(path)
+        if path in self.upcoming:
+            self.upcoming.remove(path)
+
+    def show(self, path, paused=False):
+        self.current = path
+        self.on_screen = True
+        self.pool.park(path)
+        self.start_clock(self.step['duration'], paused)
+
+    def finish(self):
+        # 表示した画像をプールに戻す (プールは次のセッションでも使われうる)
+        self.pool.unpark_all()
+
+    # --- 遷移 ---
+    def complete_current(self):
+        # ステップが終わったら True
+        if self.current is None:
+            return False
+        self.on_screen = False
+        self.history.append(self.current)
+        self.stats.increment_count(self.current)
+        self.done_in_step += 1
+        step = self.step
+        if step['count'] > 0 and self.done_in_step >= step['count']:
+            self.step_index += 1
+            self.done_in_step = 0
+            return True
+        return False
+
+    def skip_current(self):
+        self.on_screen = False
+        self.skipped.append(self.current)
+
+    def moved_current(self):
+        # 移動はバックグラウンドで行うので、完了を待たずにプールから外す
+        self.on_screen = False
+        self.pool.discard(self.current)
+        self.skipped.append(self.current)
+
+    def move_finished(self, src, dst):
+        self.skipped = [dst if p == src else p for p in self.skipped]
+
+    def move_failed(self, src):
+        if src in self.skipped and os.path.exists(src):
+            self.pool.add(src)
+
+    # --- 時計 ---
+    def start_clock(self, duration, paused=False):
+        self.duration = float(duration)
+        self.deadline = self.clock() + duration
+        self.stopped_remaining = float(duration) if paused else None
+
+    def remaining(self):
+        if self.stopped_remaining is not None:
+            return self.stopped_remaining
+        return max(0.0, self.deadline - self.clock())
+
+    def pause(self):
+        if self.stopped_remaining is None:
+            self.stopped_remaining = self.remaining()
+
+    def resume(self):
+        if self.stopped_remaining is not None:
+            self.deadline = self.clock() + self.stopped_remaining
+            self.stopped_remaining = None
+
+# --- 設定管理クラス ---
+class AppConfigManager:
+    def __init__(self):
+        self.config = {
+            "window_size": [1000, 800],
+            "language": "en",
+            "last_preset_data": None,
+            "last_set_name": "Custom",
+            "always_on_top": False,
+            "move_target_folder": "",
+            "prefetch_depth": 3,
+            "decoder_backend": "auto",  # auto / qt / pillow
+            "thumb_cache_mb": 200,
+            "move_undo_limit": 20,  # リザルト画面で元に戻せる移動の数
+            "image_cache_mb": 512,  # ビューアー・レビュー・サムネイル一覧で共有するメモリ上の画像の上限
+            "selection_policy": "min_count",  # min_count: 表示回数が最少の画像から / weighted: 重み付き抽選
+            "selection_weights": {"count": 1.0, "recency_days": 7.0, "pin": 4.0},
+            "near_duplicate_distance": 4,  # 知覚ハッシュの差がこのビット数以下なら同じ画像とみなす (0 で無効)
+            "perf_overlay": False,  # F3 で切り替え
+            "perf_log": True        # セッション終了時に PERF_LOG_FILE へ追記
+        }
+        self.load_config()
+
+    def load_config(self):
+        if os.path.exists(CONFIG_FILE):
+            try:
+                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    self.config.update(data)
+            except:
+                pass
+
+    def save_config(self):
+        try:
+            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+                json.dump(self.config, f, ensure_ascii=False, indent=2)
+        except:
+            pass
+
+config_manager = AppConfigManager()
+
+# --- ZIP/CBZ アーカイブ ---
+# アーカイブは展開せず、中央ディレクトリから画像の一覧を作り、中身はメモリマップから直接読む。
+# アーカイブ内の画像のパスは「アーカイブのパス + os.sep + アーカイブ内の名前」で表す
+ARCHIVE_MEMBER_RE = re.compile(r"\.(?:zip|cbz)(?=[\\/])", re.IGNORECASE)
+
+def split_archive_path(path):
+    # (アーカイブのパス, アーカイブ内の名前) を返す。通常のファイルなら (None, None)
+    for match in ARCHIVE_MEMBER_RE.finditer(path):
+        archive = path[:match.end()]
+        if os.path.isfile(archive):
+            return archive, path[match.end() + 1:]
+    return None, None
+
+def is_archive_member(path):
+    return split_archive_path(path)[0] is not None
+
+class MappedArchive:
+    def __init__(self, path, st):
+        import zipfile
+        self.path = path
+        self.stamp = (st.st_size, st.st_mtime_ns)
+        try:
+            with open(path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with zipfile.ZipFile(path) as zf:
+                infos = zf.infolist()
+        except (zipfile.BadZipFile, ValueError) as e:
+            raise OSError(f"{path}: {e}") from e
+        # 暗号化されたものとフォルダは除く
+        self.members = {info.filename: info for info in infos
+                        if not info.is_dir() and not info.flag_bits & 0x1
+                        and os.path.splitext(info.filename)[1].lower() in IMAGE_EXTENSIONS}
+
+    def read(self, name, limit=None):
+        # 展開した中身を返す。limit を指定すると先頭の limit バイトまで
+        import zipfile
+        info = self.members.get(name)
+        if info is None:
+            raise FileNotFoundError(f"{self.path}: {name}")
+        offset = info.header_offset
+        header = self.map[offset:offset + 30]
+        if len(header) < 30 or header[:4] != b"PK\x03\x04":
+            raise OSError(f"{self.path}: bad local header for {name}")
+        # 中身はローカルヘッダー (30 バイト + 名前 + 拡張フィールド) の直後にある
+        start = offset + 30 + int.from_bytes(header[26:28], "little") + int.from_bytes(header[28:30], "little")
+        length = info.file_size if limit is None else min(limit, info.file_size)
+        if info.compress_type == zipfile.ZIP_STORED:
+            return self.map[start:start + length]
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            with memoryview(self.map) as view:
+                try:
+                    return zlib.decompressobj(-15).decompress(view[start:start + info.compress_size], length)
+                except zlib.error as e:
+                    raise OSError(f"{self.path}: {name}: {e}") from e
+        # bzip2 / LZMA などはまれなので zipfile に任せる
+        try:
+            with zipfile.ZipFile(self.path) as zf:
+                return zf.read(info)[:length]
+        except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+            raise OSError(f"{self.path}: {name}: {e}") from e
+
+# 開いたアーカイブ (中央ディレクトリとメモリマップ) を使い回す。
+# 書き換えられたアーカイブはサイズと更新日時で見分けて開き直す。
+# 追い出したマップは閉じず、読み込み中のスレッドが手放した時点で解放される
+class ArchiveReader:
+    def __init__(self, max_open=ARCHIVE_MAX_OPEN):
+        self.max_open = max_open
+        self.lock = threading.Lock()
+        self.archives = OrderedDict()
+
+    def open(self, path):
+        st = os.stat(path)
+        with self.lock:
+            archive = self.archives.get(path)
+            if archive is not None and archive.stamp == (st.st_size, st.st_mtime_ns):
+                self.archives.move_to_end(path)
+                return archive
+        archive = MappedArchive(path, st)
+        with self.lock:
+            self.archives[path] = archive
+            self.archives.move_to_end(path)
+            while len(self.archives) > self.max_open:
+                self.archives.popitem(last=False)
+        return archive
+
+    def list_images(self, path):
+        return [path + os.sep + name for name in self.open(path).members]
+
+    def read(self, path, limit=None):
+        archive, name = split_archive_path(path)
+        if archive is None:
+            raise FileNotFoundError(path)
+        return self.open(archive).read(name, limit)
+
+    def stat(self, path):
+        # (サイズ, 更新日時)。更新日時はアーカイブ自体のもの
+        archive, name = split_archive_path(path)
+        if archive is None:
+            raise FileNotFoundError(path)
+        opened = self.open(archive)
+        info = opened.members.get(name)
+        if info is None:
+            raise FileNotFoundError(path)
+        return info.file_size, opened.stamp[1]
+
+archive_reader = ArchiveReader()
+
+def image_stat(path):
+    # 通常のファイルとアーカイブ内の画像の両方について (サイズ, 更新日時) を返す
+    if is_archive_member(path):
+        return archive_reader.stat(path)
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def image_exists(path):
+    try:
+        image_stat(path)
+    except OSError:
+        return False
+    return True
+
+def open_image_reader(path, limit=None):
+    # アーカイブ内の画像はメモリ上のバッファから読む (バッファはリーダーに持たせておく)
+    if not is_archive_member(path):
+        return QImageReader(path)
+    try:
+        data = archive_reader.read(path, limit)
+    except OSError:
+        data = b""
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+    reader = QImageReader(buffer)
+    reader.buffer = buffer
+    return reader
+
+# --- 画像デコード ---
+# 表示サイズ付近まで縮小しながら読み込む (巨大な画像をフル解像度で展開しない)
+_pillow_image = None
+
+def get_pillow():
+    # Pillow は任意の依存。無ければ Qt だけで読み込む
+    global _pillow_image
+    if _pillow_image is None:
+        try:
+            from PIL import Image
+            _pillow_image = Image
+        except ImportError:
+            _pillow_image = False
+    return _pillow_image or None
+
+def decode_image_qt(path, target_size=None):
+    reader = open_image_reader(path)
+    source_size = reader.size()
+    if target_size is not None and source_size.isValid() and target_size.isValid():
+        if source_size.width() > target_size.width() or source_size.height() > target_size.height():
+            # JPEG ではデコーダ側 (DCT) で縮小される
+            reader.setScaledSize(source_size.scaled(target_size, Qt.AspectRatioMode.KeepAspectRatio))
+    return reader.read(), source_size
+
+def decode_image_pillow(path, target_size=None):
+    Image = get_pillow()
+    if Image is None:
+        return decode_image_qt(path, target_size)
+    try:
+        source = io.BytesIO(archive_reader.read(path)) if is_archive_member(path) else path
+        with Image.open(source) as im:
+            source_size = QSize(*im.size)
+            if target_size is not None and target_size.isValid():
+                bounds = (target_size.width(), target_size.height())
+                im.draft("RGB", bounds)  # JPEG の DCT 領域での縮小
+                im = im.convert("RGBA")
+                im.thumbnail(bounds, Image.Resampling.LANCZOS)
+            else:
+                im = im.convert("RGBA")
+            data = im.tobytes("raw", "RGBA")
+            image = QImage(data, im.width, im.height, im.width * 4, QImage.Format.Format_RGBA8888).copy()
+        return image, source_size
+    except Exception:
+        return decode_image_qt(path, target_size)
+
+DECODER_BACKENDS = {
+    "qt": decode_image_qt,
+    "pillow": decode_image_pillow,
+}
+
+@perf.timed("decode_image")
+def decode_image(path, target_size=None):
+    # (画像, 元画像のサイズ) を返す。読み込めない場合は null の QImage
+    backend = config_manager.config.get("decoder_backend", "auto")
+    if backend == "auto":
+        is_jpeg = os.path.splitext(path)[1].lower() in ('.jpg', '.jpeg')
+        backend = "pillow" if is_jpeg and get_pillow() else "qt"
+    decoder = DECODER_BACKENDS.get(backend, decode_image_qt)
+    return decoder(path, target_size)
+
+def create_executor(max_workers):
+    # concurrent.futures の import は起動を遅くするので、最初に使うときに読み込む
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+def display_size(widget=None):
+    # 画面サイズより大きく表示することはないので、これをデコードの上限にする
+    screen = widget.screen() if widget is not None else QApplication.primaryScreen()
+    if screen is None:
+        return None
+    return screen.size()
+
+# --- 共通ヘルパー関数 ---
+def is_archive_file(path):
+    return os.path.splitext(path)[1].lower() in ARCHIVE_EXTENSIONS and os.path.isfile(path)
+
+def list_image_dir(path):
+    # アーカイブはサブフォルダとして返し、アーカイブを渡されたら中の画像を返す
+    if is_archive_file(path):
+        return archive_reader.list_images(path), []
+    files, subdirs = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    # os.walk と同様にシンボリックリンク先のフォルダには潜らない
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                else:
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if ext in IMAGE_EXTENSIONS:
+                        files.append(entry.path)
+                    elif ext in ARCHIVE_EXTENSIONS:
+                        subdirs.append(entry.path)
+            except OSError:
+                continue
+    return files, subdirs
+
+def walk_image_files(path, on_files=None, cancel_event=None):
+    image_paths = []
+    stack = [path]
+    while stack:
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        try:
+            files, subdirs = list_image_dir(stack.pop())
+        except OSError:
+            continue
+        if on_files and files:
+            on_files(files)
+        image_paths.extend(files)
+        stack.extend(subdirs)
+    return image_paths
+
+def dir_stamp(path):
+    # (更新日時, サイズ)。アーカイブはその場で書き換えられても分かるようにサイズも見る
+    st = os.stat(path)
+    return (st.st_mtime_ns, None if stat.S_ISDIR(st.st_mode) else st.st_size)
+
+# --- ライブラリインデックス (SQLite) ---
+# フォルダごとのファイル一覧をディレクトリの mtime 付きでキャッシュし、
+# 変更のあったディレクトリだけを読み直す
+# ファイルはヘッダーだけを読んで検査し (画素はデコードしない)、
+# 読めないものは error 付きで記録してセッションの対象から外す。
+# 内容の指紋は on_identities が指定されたときだけ、一覧を返し終えてから計算する。
+# 知覚ハッシュ (phash) は PerceptualIndexer が後から埋める。
+# ZIP/CBZ アーカイブはフォルダと同じく dirs に記録し、アーカイブ自体のサイズか更新日時が
+# 変わったら (フォルダに変更がなくても) 読み直す
+class LibraryIndex:
+    SCHEMA_VERSION = 6
+    COMMIT_INTERVAL = 0.5
+
+    def __init__(self, db_path=INDEX_FILE, lazy=False):
+        self.db_path = db_path
+        self.init_lock = threading.Lock()
+        self.initialized = False
+        self.usable = True
+        if not lazy:
+            self.ensure_ready()
+
+    @property
+    def available(self):
+        self.ensure_ready()
+        return self.usable
+
+    def ensure_ready(self):
+        # DB を開いて表を用意する。走査の各スレッドから同時に呼ばれても一度だけ行う
+        if self.initialized:
+            return
+        with self.init_lock:
+            if self.initialized:
+                return
+            try:
+                conn = self.open_db()
+                try:
+                    self.init_db(conn)
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                self.usable = False
+            self.initialized = True
+
+    def connect(self):
+        self.ensure_ready()
+        return self.open_db()
+
+    def open_db(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def init_db(self, conn):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == self.SCHEMA_VERSION:
+            return
+        # インデックスはキャッシュなので、形式が変わったら作り直す
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS dirs")
+            conn.execute("DROP TABLE IF EXISTS files")
+            conn.execute("""CREATE TABLE dirs (
+                root TEXT NOT NULL, path TEXT NOT NULL, parent TEXT,
+                mtime_ns INTEGER NOT NULL, size INTEGER, PRIMARY KEY (root, path))""")
+            conn.execute("""CREATE TABLE files (
+                root TEXT NOT NULL, path TEXT NOT NULL, dir TEXT NOT NULL,
+                size INTEGER, mtime_ns INTEGER, width INTEGER, height INTEGER,
+                format TEXT, error TEXT, fingerprint TEXT, phash INTEGER, PRIMARY KEY (root, path))""")
+            conn.execute("CREATE INDEX files_dir ON files (root, dir)")
+            conn.execute("CREATE INDEX files_path ON files (path)")
+            conn.execute("CREATE INDEX files_broken ON files (root) WHERE error IS NOT NULL")
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def scan(self, root, on_files=None, cancel_event=None, on_broken=None, on_identities=None):
+        conn = self.connect()
+        try:
+            with conn:
+                return self._scan(conn, root, on_files, cancel_event, on_broken, on_identities)
+        finally:
+            conn.close()
+
+    def probe_files(self, conn, root, dir_path, files):
+        # 新しいファイルと、サイズか更新日時が変わったファイルだけを検査し直す
+        known = {}
+        for path, size, mtime_ns, width, height, fmt, error, fingerprint, phash in conn.execute(
+                "SELECT path, size, mtime_ns, width, height, format, error, fingerprint, phash FROM files WHERE root = ? AND dir = ?",
+                (root, dir_path)):
+            known[path] = (size, mtime_ns, width, height, fmt, error, fingerprint, phash)
+        rows = []
+        for path in files:
+            try:
+                size, mtime_ns = image_stat(path)
+            except OSError:
+                continue
+            cached = known.get(path)
+            if cached is not None and cached[0] == size and cached[1] == mtime_ns:
+                info = cached[2:]
+            else:
+                info = probe_image(path) + (None, None)
+            rows.append((root, path, dir_path, size, mtime_ns) + tuple(info))
+        return rows
+
+    def _scan(self, conn, root, on_files, cancel_event, on_broken, on_identities):
+        cached_stamps = {}
+        cached_children = {}
+        for path, parent, mtime_ns, size in conn.execute(
+                "SELECT path, parent, mtime_ns, size FROM dirs WHERE root = ?", (root,)):
+            cached_stamps[path] = (mtime_ns, size)
+            cached_children.setdefault(parent, []).append(path)
+        cached_files = {}
+        cached_fingerprints = {}
+        for dir_path, path, fingerprint in conn.execute(
+                "SELECT dir, path, fingerprint FROM files WHERE root = ? AND error IS NULL", (root,)):
+            cached_files.setdefault(dir_path, []).append(path)
+            if fingerprint is not None:
+                cached_fingerprints[path] = fingerprint
+        # 壊れたファイルはフォルダに変更がなくても、ファイル自体が差し替えられていれば検査し直す
+        cached_broken = {}
+        for dir_path, path in conn.execute(
+                "SELECT dir, path FROM files WHERE root = ? AND error IS NOT NULL", (root,)):
+            cached_broken.setdefault(dir_path, []).append(path)
+
+        image_paths = []
+        unidentified = []
+        seen_dirs = set()
+        stack = [(root, None)]
+        last_commit = time.monotonic()
+        while stack:
+            if cancel_event is not None and cancel_event.is_set():
+                # 途中までの結果では消えたフォルダを判定できないので、ここで打ち切る
+                return image_paths
+            dir_path, parent = stack.pop()
+            try:
+                stamp = dir_stamp(dir_path)
+            except OSError:
+                continue
+            seen_dirs.add(dir_path)
+
+            if cached_stamps.get(dir_path) == stamp:
+                files = cached_files.get(dir_path, [])
+                subdirs = cached_children.get(dir_path, [])
+                broken = []
+                if dir_path in cached_broken:
+                    rows = self.probe_files(conn, root, dir_path, cached_broken[dir_path])
+                    conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                    files = files + [r[1] for r in rows if r[8] is None]
+                    broken = [(r[1], r[8]) for r in rows if r[8] is not None]
+                identities = [(f, cached_fingerprints[f]) for f in files if f in cached_fingerprints]
+            else:
+                try:
+                    rows, subdirs = self.update_dir(conn, root, dir_path, parent, stamp)
+                except OSError:
+                    continue
+                files = [r[1] for r in rows if r[8] is None]
+                broken = [(r[1], r[8]) for r in rows if r[8] is not None]
+                identities = [(r[1], r[9]) for r in rows if r[8] is None and r[9] is not None]
+                # 複数フォルダを並列に走査するので、書き込みロックを長く握らない
+                if time.monotonic() - last_commit >= self.COMMIT_INTERVAL:
+                    conn.commit()
+                    last_commit = time.monotonic()
+
+            if on_files and files:
+                on_files(files)
+            if on_broken and broken:
+                on_broken(broken)
+            if on_identities:
+                if identities:
+                    on_identities(identities)
+                if len(identities) < len(files):
+                    known = {p for p, _ in identities}
+                    unidentified.extend(f for f in files if f not in known)
+            image_paths.extend(files)
+            stack.extend((d, dir_path) for d in subdirs)
+
+        # 消えたディレクトリをインデックスから削除
+        gone = [(root, d) for d in cached_stamps if d not in seen_dirs]
+        if gone:
+            conn.executemany("DELETE FROM dirs WHERE root = ? AND path = ?", gone)
+            conn.executemany("DELETE FROM files WHERE root = ? AND dir = ?", gone)
+        if unidentified:
+            conn.commit()
+            self.identify_files(conn, root, unidentified, on_identities, cancel_event)
+        return image_paths
+
+    def update_dir(self, conn, root, dir_path, parent, stamp):
+        # フォルダを読み直してインデックスを書き換え、(ファイルの行, サブフォルダ) を返す
+        files, subdirs = list_image_dir(dir_path)
+        rows = self.probe_files(conn, root, dir_path, files)
+        conn.execute("DELETE FROM files WHERE root = ? AND dir = ?", (root, dir_path))
+        conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT OR REPLACE INTO dirs (root, path, parent, mtime_ns, size) VALUES (?, ?, ?, ?, ?)",
+                     (root, dir_path, parent) + stamp)
+        return rows, subdirs
+
+    def refresh(self, root, dirs):
+        # 変更通知のあったフォルダだけを読み直し、(追加, 削除, 追加分の指紋, 増えたフォルダ, 消えたフォルダ) を返す
+        added, removed, new_dirs, gone_dirs = [], [], [], []
+        conn = self.connect()
+        try:
+            with conn:
+                for dir_path in dirs:
+                    row = conn.execute("SELECT parent FROM dirs WHERE root = ? AND path = ?", (root, dir_path)).fetchone()
+                    if row is None:
+                        continue
+                    old_files = {p for (p,) in conn.execute(
+                        "SELECT path FROM files WHERE root = ? AND dir = ? AND error IS NULL", (root, dir_path))}
+                    old_subdirs = {p for (p,) in conn.execute(
+                        "SELECT path FROM dirs WHERE root = ? AND parent = ?", (root, dir_path))}
+                    try:
+                        rows, subdirs = self.update_dir(conn, root, dir_path, row[0], dir_stamp(dir_path))
+                    except OSError:
+                        self.remove_tree(conn, root, dir_path, removed, gone_dirs)
+                        continue
+                    files = {r[1] for r in rows if r[8] is None}
+                    added.extend(files - old_files)
+                    removed.extend(old_files - files)
+                    for d in set(subdirs) - old_subdirs:
+                        self.add_tree(conn, root, d, dir_path, added, new_dirs)
+                    for d in old_subdirs - set(subdirs):
+                        self.remove_tree(conn, root, d, removed, gone_dirs)
+
+                identities = []
+                for path in added:
+                    try:
+                        fingerprint = fingerprint_file(path, image_stat(path)[0])
+                    except OSError:
+                        continue
+                    conn.execute("UPDATE files SET fingerprint = ? WHERE root = ? AND path = ?", (fingerprint, root, path))
+                    identities.append((path, fingerprint))
+        finally:
+            conn.close()
+        return added, removed, identities, new_dirs, gone_dirs
+
+    def add_tree(self, conn, root, dir_path, parent, added, new_dirs):
+        stack = [(dir_path, parent)]
+        while stack:
+            dir_path, parent = stack.pop()
+            try:
+                rows, subdirs = self.update_dir(conn, root, dir_path, parent, dir_stamp(dir_path))
+            except OSError:
+                continue
+            new_dirs.append(dir_path)
+            added.extend(r[1] for r in rows if r[8] is None)
+            stack.extend((d, dir_path) for d in subdirs)
+
+    def remove_tree(self, conn, root, dir_path, removed, gone_dirs):
+        # dir_path 以下 (区切り文字の次の文字コードまでの範囲) をまとめて消す
+        low, high = dir_path + os.sep, dir_path + chr(ord(os.sep) + 1)
+        dirs = [dir_path] + [p for (p,) in conn.execute(
+            "SELECT path FROM dirs WHERE root = ? AND path >= ? AND path < ?", (root, low, high))]
+        for d in dirs:
+            removed.extend(p for (p,) in conn.execute(
+                "SELECT path FROM files WHERE root = ? AND dir = ? AND error IS NULL", (root, d)))
+            conn.execute("DELETE FROM files WHERE root = ? AND dir = ?", (root, d))
+            conn.execute("DELETE FROM dirs WHERE root = ? AND path = ?", (root, d))
+        gone_dirs.extend(dirs)
+
+    def dirs(self, root):
+        conn = self.connect()
+        try:
+            return [p for (p,) in conn.execute("SELECT path FROM dirs WHERE root = ?", (root,))]
+        finally:
+            conn.close()
+
+    def identify_files(self, conn, root, paths, on_identities, cancel_event):
+        batch = []
+        last_commit = time.monotonic()
+        for path in paths:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            try:
+                size, mtime_ns = image_stat(path)
+                fingerprint = fingerprint_file(path, size)
+            except OSError:
+                continue
+            # 一覧を作った後に書き換えられていたら記録しない
+            conn.execute("UPDATE files SET fingerprint = ? WHERE root = ? AND path = ? AND size = ? AND mtime_ns = ?",
+                         (fingerprint, root, path, size, mtime_ns))
+            batch.append((path, fingerprint))
+            if len(batch) >= SCAN_BATCH_SIZE or time.monotonic() - last_commit >= self.COMMIT_INTERVAL:
+                conn.commit()
+                last_commit = time.monotonic()
+                on_identities(batch)
+                batch = []
+        if batch:
+            on_identities(batch)
+
+    def phashes(self, roots):
+        # 計算済みの知覚ハッシュ {パス: ハッシュ}
+        result = {}
+        conn = self.connect()
+        try:
+            for root in roots:
+                for path, phash in conn.execute(
+                        "SELECT path, phash FROM files WHERE root = ? AND phash IS NOT NULL", (root,)):
+                    result[path] = phash & PHASH_MASK
+        finally:
+            conn.close()
+        return result
+
+    def store_phashes(self, pairs):
+        # SQLite の INTEGER は符号付き 64 ビットなので、上位ビットが立つ値は負数にして保存する
+        conn = self.connect()
+        try:
+            with conn:
+                conn.executemany("UPDATE files SET phash = ? WHERE path = ?",
+                                 [(h - (1 << 64) if h >> 63 else h, path) for path, h in pairs])
+        finally:
+            conn.close()
+
+    def mark_broken(self, path, error):
+        # 検査は通ったがデコードに失敗したファイル。次回の走査からは除外される
+        if not self.available:
+            return
+        try:
+            conn = self.connect()
+            try:
+                with conn:
+                    conn.execute("UPDATE files SET error = ? WHERE path = ?", (error, path))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+    def move_file(self, src, dst):
+        # 移動したファイルの行を付け替える (指紋や知覚ハッシュを計算し直さない)。
+        # 移動先が同じルートの外なら行を消し、次の走査で見つかれば入り直す
+        if not self.available:
+            return
+        try:
+            conn = self.connect()
+            try:
+                with conn:
+                    for (root,) in conn.execute("SELECT root FROM files WHERE path = ?", (src,)).fetchall():
+                        if dst.startswith(root.rstrip(os.sep) + os.sep):
+                            conn.execute("DELETE FROM files WHERE root = ? AND path = ?", (root, dst))
+                            conn.execute("UPDATE files SET path = ?, dir = ? WHERE root = ? AND path = ?",
+                                         (dst, os.path.dirname(dst), root, src))
+                        else:
+                            conn.execute("DELETE FROM files WHERE root = ? AND path = ?", (root, src))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+# 起動時には開かず、最初の走査で使うときに DB を用意する
+library_index = LibraryIndex(lazy=True)
+
+def probe_image(path):
+    # ヘッダーだけを読んで (幅, 高さ, 形式, エラー) を返す。読めるファイルはエラーが None
+    result = probe_reader(open_image_reader(path, ARCHIVE_PROBE_BYTES))
+    if result[3] is not None and is_archive_member(path):
+        # 大きなメタデータ付きの JPEG などは先頭だけでは大きさが分からないので、全体を読んで確かめる
+        result = probe_reader(open_image_reader(path))
+    return result
+
+def probe_reader(reader):
+    if not reader.canRead():
+        return (None, None, None, reader.errorString() or "unreadable")
+    size = reader.size()
+    fmt = bytes(reader.format()).decode("ascii", "replace")
+    if not size.isValid() or size.isEmpty():
+        return (None, None, fmt, "invalid image size")
+    return (size.width(), size.height(), fmt, None)
+
+def fingerprint_file(path, size=None):
+    # サイズと先頭・中央・末尾の一部だけのハッシュ。同じ内容のファイルは同じ値になる
+    digest = hashlib.blake2b(digest_size=16)
+    if is_archive_member(path):
+        # 展開後の中身から同じ位置を読むので、展開したファイルと同じ指紋になる
+        data = archive_reader.read(path)
+        size = len(data)
+        if size <= FINGERPRINT_CHUNK * 3:
+            digest.update(data)
+        else:
+            for offset in (0, size // 2 - FINGERPRINT_CHUNK // 2, size - FINGERPRINT_CHUNK):
+                digest.update(data[offset:offset + FINGERPRINT_CHUNK])
+        return f"{size:x}:{digest.hexdigest()}"
+    if size is None:
+        size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if size <= FINGERPRINT_CHUNK * 3:
+            digest.update(f.read())
+        else:
+            for offset in (0, size // 2 - FINGERPRINT_CHUNK // 2, size - FINGERPRINT_CHUNK):
+                f.seek(offset)
+                digest.update(f.read(FINGERPRINT_CHUNK))
+    return f"{size:x}:{digest.hexdigest()}"
+
+def write_broken_report(broken, path=BROKEN_REPORT_FILE):
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            for file_path, error in sorted(broken):
+                f.write(f"{file_path}\t{error}\n")
+    except OSError:
+        pass
+
+@perf.timed("scan_image_root")
+def scan_image_root(path, on_files=None, cancel_event=None, on_broken=None, on_identities=None):
+    if library_index.available:
+        try:
+            return library_index.scan(path, on_files, cancel_event, on_broken, on_identities)
+        except sqlite3.Error:
+            pass
+    return walk_image_files(path, on_files, cancel_event)
+
+@perf.timed("get_image_files")
+def get_image_files(folders):
+    image_paths = []
+    for folder_data in folders:
+        if not folder_data["checked"]: continue
+        path = folder_data["path"]
+        if os.path.isdir(path):
+            image_paths.extend(scan_image_root(path))
+    return image_paths
+
+# --- 知覚ハッシュによる似た画像のまとめ ---
+# 連写や縮小して再保存した画像など、見た目がほぼ同じ画像を 1 枚として扱うために使う
+def perceptual_hash(path):
+    # 64 ビットの dHash。9x8 のグレースケールに縮小して、横に隣り合う画素の明暗を並べる。
+    # JPEG はデコード時に縮小されるので全画素は展開しない
+    reader = open_image_reader(path)
+    reader.setScaledSize(QSize(9, 8))
+    image = reader.read()
+    if image.isNull():
+        return None
+    image = image.convertToFormat(QImage.Format.Format_Grayscale8)
+    if image.width() != 9 or image.height() != 8:
+        image = image.scaled(9, 8, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+    ptr = image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    data = bytes(ptr)
+    stride = image.bytesPerLine()
+    value = 0
+    for y in range(8):
+        row = data[y * stride:y * stride + 9]
+        for x in range(8):
+            value = (value << 1) | (row[x] < row[x + 1])
+    return value
+
+_numpy = None
+
+def get_numpy():
+    # NumPy は任意の依存。無ければ同じ処理を Python だけで行う
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+def hash_bands(max_distance):
+    # 距離が max_distance 以下の 2 つのハッシュは、64 ビットを max_distance + 1 個に分けた
+    # どれかのバンドで必ず完全に一致する (鳩の巣原理)。比べるのは同じバンド値を持つものだけでよい
+    count = max_distance + 1
+    bands = []
+    shift = 0
+    for i in range(count):
+        width = 64 // count + (1 if i < 64 % count else 0)
+        bands.append((shift, (1 << width) - 1))
+        shift += width
+    return bands
+
+def cluster_hashes(hashes, max_distance):
+    # 差が max_distance ビット以下のハッシュを同じグループにまとめ、各要素のグループ番号を返す
+    if not hashes:
+        return []
+    np = get_numpy()
+    if np is not None:
+        values, inverse = np.unique(np.array(hashes, dtype=np.uint64), return_inverse=True)
+        pairs = close_pairs_numpy(np, values, max_distance)
+        unique = len(values)
+        inverse = inverse.reshape(-1).tolist()
+    else:
+        values = sorted(set(hashes))
+        index = {h: i for i, h in enumerate(values)}
+        inverse = [index[h] for h in hashes]
+        pairs = close_pairs_python(values, max_distance)
+        unique = len(values)
+
+    parent = list(range(unique))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for a, b in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return [find(i) for i in inverse]
+
+def close_pairs_numpy(np, values, max_distance):
+    # バンドごとにハッシュを並べ替え、同じバンド値が続く範囲だけを offset ずらしでまとめて比べる
+    pairs = []
+    for shift, mask in hash_bands(max_distance):
+        keys = (values >> np.uint64(shift)) & np.uint64(mask)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        for offset in range(1, min(len(values), PHASH_MAX_RUN + 1)):
+            same = sorted_keys[offset:] == sorted_keys[:-offset]
+            if not same.any():
+                break
+            a = order[:-offset][same]
+            b = order[offset:][same]
+            xor = values[a] ^ values[b]
+            if hasattr(np, "bitwise_count"):
+                distance = np.bitwise_count(xor)
+            else:
+                distance = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+            close = distance <= max_distance
+            pairs.extend(zip(a[close].tolist(), b[close].tolist()))
+    return pairs
+
+def close_pairs_python(values, max_distance):
+    pairs = []
+    for shift, mask in hash_bands(max_distance):
+        buckets = {}
+        for i, h in enumerate(values):
+            buckets.setdefault((h >> shift) & mask, []).append(i)
+        for members in buckets.values():
+            for n, a in enumerate(members):
+                for b in members[n + 1:n + 1 + PHASH_MAX_RUN]:
+                    if (values[a] ^ values[b]).bit_count() <= max_distance:
+                        pairs.append((a, b))
+    return pairs
+
+# --- バックグラウンドでのフォルダ走査 ---
+# 見つかった画像を少しずつ files_found で流すので、全体の走査を待たずにセッションを始められる。
+# 画像の指紋はわかったものから identities_found で流す
+class FolderScanner(QObject):
+    files_found = pyqtSignal(list)
+    identities_found = pyqtSignal(list)  # [(パス, 指紋), ...]
+    scan_finished = pyqtSignal(int)
+    stopped = pyqtSignal()  # 取り消しを含め、全てのルートの走査が終わった
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # ワーカーが最後のシグナルを送り終えてから破棄する
+        self.stopped.connect(self.deleteLater)
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pending = 0
+        self.total_found = 0
+        self.broken = []  # (path, error)
+
+    def start(self, folders):
+        roots = [f["path"] for f in folders if f["checked"] and os.path.isdir(f["path"])]
+        if not roots:
+            self.scan_finished.emit(0)
+            self.stopped.emit()
+            return
+        self.pending = len(roots)
+        self.executor = create_executor(min(SCAN_WORKERS, len(roots)))
+        for root in roots:
+            self.executor.submit(self.scan_root, root)
+        self.executor.shutdown(wait=False)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def scan_root(self, root):
+        buffer = []
+        identity_buffer = []
+        last_emit = 0.0
+
+        def flush():
+            # 指紋より先にファイルを送る
+            if buffer:
+                self.emit_files(buffer[:])
+                buffer.clear()
+            if identity_buffer and not self.cancel_event.is_set():
+                self.identities_found.emit(identity_buffer[:])
+                identity_buffer.clear()
+
+        def maybe_flush():
+            nonlocal last_emit
+            now = time.monotonic()
+            if len(buffer) + len(identity_buffer) >= SCAN_BATCH_SIZE or now - last_emit >= SCAN_EMIT_INTERVAL:
+                flush()
+                last_emit = now
+
+        def on_files(files):
+            buffer.extend(files)
+            maybe_flush()
+
+        def on_identities(identities):
+            identity_buffer.extend(identities)
+            maybe_flush()
+
+        def on_broken(broken):
+            with self.lock:
+                self.broken.extend(broken)
+
+        try:
+            scan_image_root(root, on_files, self.cancel_event, on_broken, on_identities)
+        except Exception as e:
+            # 走査できなかったルートは読めないファイルと同じく報告する
+            on_broken([(root, f"{type(e).__name__}: {e}")])
+        flush()
+        with self.lock:
+            self.pending -= 1
+            done = self.pending == 0
+        if done:
+            if not self.cancel_event.is_set():
+                self.scan_finished.emit(self.total_found)
+            self.stopped.emit()
+
+    def emit_files(self, files):
+        if self.cancel_event.is_set():
+            return
+        with self.lock:
+            self.total_found += len(files)
+        self.files_found.emit(files)
+
+# --- 知覚ハッシュの計算 (バックグラウンド) ---
+# 走査が終わった画像の知覚ハッシュをインデックスから読み、足りない分だけ計算して保存する。
+# 全部そろったら似た画像のグループを clusters_ready で返す
+class PerceptualIndexer(QObject):
+    clusters_ready = pyqtSignal(int, list)  # 世代, [[パス, ...], ...]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self.cancel_event = threading.Event()
+
+    def start(self, roots, paths, max_distance):
+        self.cancel()
+        self.generation += 1
+        self.cancel_event = threading.Event()
+        executor = create_executor(1)
+        executor.submit(self.run, self.generation, self.cancel_event, roots, paths, max_distance)
+        executor.shutdown(wait=False)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self, generation, cancel_event, roots, paths, max_distance):
+        known = {}
+        if library_index.available:
+            try:
+                known = library_index.phashes(roots)
+            except sqlite3.Error:
+                pass
+        hashes = {p: known[p] for p in paths if p in known}
+        missing = [p for p in paths if p not in known]
+
+        def compute(path):
+            if cancel_event.is_set():
+                return None
+            return perceptual_hash(path)
+
+        batch = []
+        with create_executor(PHASH_WORKERS) as executor:
+            for path, value in zip(missing, executor.map(compute, missing)):
+                if cancel_event.is_set():
+                    return
+                if value is None:
+                    continue
+                hashes[path] = value
+                batch.append((path, value))
+                if len(batch) >= PHASH_BATCH_SIZE:
+                    self.store(batch)
+                    batch = []
+        self.store(batch)
+        if cancel_event.is_set():
+            return
+
+        # 単色に近い画像はどれもほぼ同じハッシュになるので、グループ分けの対象にしない
+        ordered = [p for p, h in hashes.items()
+                   if PHASH_MIN_DETAIL < h.bit_count() < 64 - PHASH_MIN_DETAIL]
+        labels = cluster_hashes([hashes[p] for p in ordered], max_distance)
+        groups = {}
+        for path, label in zip(ordered, labels):
+            groups.setdefault(label, []).append(path)
+        clusters = [g for g in groups.values() if len(g) > 1]
+        self.clusters_ready.emit(generation, clusters)
+
+    def store(self, batch):
+        if not batch or not library_index.available:
+            return
+        try:
+            library_index.store_phashes(batch)
+        except sqlite3.Error:
+            pass
+
+# --- フォルダの監視 ---
+# セッション中にフォルダへ追加・削除された画像を検出する。通知はフォルダ単位でまとめ、
+# 一括コピーなどで通知が続いても WATCH_SETTLE_MS ごとに 1 回だけインデックスを読み直す
+class LibraryWatcher(QObject):
+    changes_ready = pyqtSignal(list, list, list)  # 追加, 削除, 追加分の (パス, 指紋)
+    refreshed = pyqtSignal(int, list, list, list, list, list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+        # dirs にはアーカイブも入るので、ファイルの変更も同じように扱う
+        self.watcher.fileChanged.connect(self.on_directory_changed)
+        self.thread_pool = create_thread_pool(self, 1)
+        self.refreshed.connect(self.on_refreshed)
+        self.settle_timer = QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.timeout.connect(self.flush)
+        self.generation = 0
+        self.root_of = {}   # 監視中のフォルダ -> ルート
+        self.pending = set()
+        self.refreshing = []
+        self.first_event = None
+        self.busy = False
+
+    def start(self, roots):
+        self.stop()
+        if not library_index.available:
+            return
+        for root in roots:
+            try:
+                dirs = library_index.dirs(root)
+            except sqlite3.Error:
+                continue
+            self.watch(root, dirs)
+
+    def stop(self):
+        self.generation += 1
+        self.settle_timer.stop()
+        self.pending.clear()
+        self.first_event = None
+        self.busy = False
+        if self.root_of:
+            self.watcher.removePaths(list(self.root_of))
+        self.root_of = {}
+
+    def watch(self, root, dirs):
+        dirs = [d for d in dirs if d not in self.root_of][:max(0, WATCH_MAX_DIRS - len(self.root_of))]
+        if not dirs:
+            return
+        failed = set(self.watcher.addPaths(dirs))
+        for d in dirs:
+            if d not in failed:
+                self.root_of[d] = root
+
+    def on_directory_changed(self, path):
+        if path not in self.root_of:
+            return
+        self.pending.add(path)
+        now = time.monotonic()
+        if self.first_event is None:
+            self.first_event = now
+        if self.busy:
+            return
+        # 通知が続く間は待つが、最初の通知から WATCH_MAX_DELAY_MS を超えたらすぐ反映する
+        waited = (now - self.first_event) * 1000
+        self.settle_timer.start(int(max(0, min(WATCH_SETTLE_MS, WATCH_MAX_DELAY_MS - waited))))
+
+    def flush(self):
+        if not self.pending or self.busy:
+            return
+        by_root = {}
+        for d in self.pending:
+            if d in self.root_of:
+                by_root.setdefault(self.root_of[d], []).append(d)
+        self.pending = set()
+        self.refreshing = [d for dirs in by_root.values() for d in dirs]
+        self.first_event = None
+        self.busy = True
+        self.thread_pool.start(FunctionTask(self.refresh, self.generation, by_root))
+
+    def refresh(self, generation, by_root):
+        # ワーカースレッドで実行される
+        added, removed, identities, new_dirs, gone_dirs = [], [], [], [], []
+        for root, dirs in by_root.items():
+            try:
+                result = library_index.refresh(root, sorted(dirs))
+            except sqlite3.Error:
+                continue
+            added += result[0]
+            removed += result[1]
+            identities += result[2]
+            new_dirs += [(root, d) for d in result[3]]
+            gone_dirs += result[4]
+        self.refreshed.emit(generation, added, removed, identities, new_dirs, gone_dirs)
+
+    def on_refreshed(self, generation, added, removed, identities, new_dirs, gone_dirs):
+        if generation != self.generation:
+            return
+        self.busy = False
+        gone = [d for d in gone_dirs if d in self.root_of]
+        if gone:
+            self.watcher.removePaths(gone)
+            for d in gone:
+                del self.root_of[d]
+        # 別のファイルで置き換えられたアーカイブは監視が外れるので付け直す
+        watched = set(self.watcher.files())
+        lost = [d for d in self.refreshing if d in self.root_of and d not in watched and os.path.isfile(d)]
+        if lost:
+            self.watcher.addPaths(lost)
+        for root, d in new_dirs:
+            self.watch(root, [d])
+        if added or removed:
+            self.changes_ready.emit(added, removed, identities)
+        if self.pending:
+            self.settle_timer.start(WATCH_SETTLE_MS)
+
+# --- サムネイルキャッシュ ---
+# パス・ファイルサイズ・更新日時をキーにディスクへ保存する。
+# 読み込むたびに更新日時を付け直し、容量を超えたら古いものから削除する (LRU)
+class ThumbnailCache:
+    def __init__(self, cache_dir=THUMB_CACHE_DIR, size=THUMB_SIZE):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.lock = threading.Lock()
+        self.total_bytes = None  # 最初の書き込み時に数える
+
+    def max_bytes(self):
+        return config_manager.config.get("thumb_cache_mb", 200) * 1024 * 1024
+
+    def entry_path(self, path):
+        try:
+            size, mtime_ns = image_stat(path)
+        except OSError:
+            return None
+        raw = f"{path}|{size}|{mtime_ns}|{self.size}"
+        key = hashlib.sha1(raw.encode('utf-8', 'surrogatepass')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + ".jpg")
+
+    def get(self, path):
+        entry = self.entry_path(path)
+        if entry is None or not os.path.exists(entry):
+            return None
+        image = QImage(entry)
+        if image.isNull():
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return image
+
+    def put(self, path, image):
+        entry = self.entry_path(path)
+        if entry is None:
+            return
+        tmp = f"{entry}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            if not image.save(tmp, "JPG", 85):
+                return
+            os.replace(tmp, entry)
+            written = os.path.getsize(entry)
+        except OSError:
+            return
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = self.disk_usage()
+            else:
+                self.total_bytes += written
+            over = self.total_bytes > self.max_bytes()
+        if over:
+            self.evict()
+
+    def load(self, path):
+        image = self.get(path)
+        if image is None:
+            image, _ = decode_image(path, QSize(self.size, self.size))
+            if not image.isNull():
+                self.put(path, image)
+        return image
+
+    def entries(self):
+        result = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                full = os.path.join(root, file)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                result.append((st.st_mtime, st.st_size, full))
+        return result
+
+    def disk_usage(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        # 上限の 9 割まで古いものから削除する
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            limit = self.max_bytes() * 0.9
+            for _, size, full in entries:
+                if total <= limit:
+                    break
+                try:
+                    os.remove(full)
+                    total -= size
+                except OSError:
+                    pass
+            self.total_bytes = total
+
+thumbnail_cache = ThumbnailCache()
+
+# --- デコード済み画像のメモリキャッシュ ---
+# ビューアー・レビュー・サムネイル一覧が共有する、バイト数で上限を決めた LRU。
+# キーは (用途, パス) で、値は QImage / QPixmap かそのタプル。UI スレッドからだけ使う
+def image_bytes(value):
+    if isinstance(value, tuple):
+        return sum(image_bytes(v) for v in value)
+    if isinstance(value, QImage):
+        return value.sizeInBytes()
+    if isinstance(value, QPixmap):
+        return value.width() * value.height() * max(value.depth(), 8) // 8
+    return 0
+
+class ImageMemoryCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # key -> (値, バイト数)
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        self.items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, value):
+        self.discard(key)
+        size = image_bytes(value)
+        self.items[key] = (value, size)
+        self.total_bytes += size
+        self.trim()
+
+    def pop(self, key):
+        item = self.items.pop(key, None)
+        if item is None:
+            return None
+        self.total_bytes -= item[1]
+        return item[0]
+
+    def discard(self, key):
+        self.pop(key)
+
+    def trim(self):
+        # 直前に入れた 1 枚は残す
+        while self.total_bytes > self.max_bytes and len(self.items) > 1:
+            _, (_, size) = self.items.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def set_limit(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.trim()
+
+    def clear(self):
+        self.items.clear()
+        self.total_bytes = 0
+
+    def summary(self):
+        mb = 1024 * 1024
+        return f"image cache {self.total_bytes / mb:.0f} / {self.max_bytes / mb:.0f} MB ({len(self.items)} items, {self.evictions} evicted)"
+
+image_cache = ImageMemoryCache(config_manager.config.get("image_cache_mb", 512) * 1024 * 1024)
+
+# --- ワーカースレッド ---
+# 終了時に全プールの処理を待ってから UI オブジェクトを破棄できるよう、作成したプールを覚えておく
+_thread_pools = weakref.WeakSet()
+
+def create_thread_pool(parent, max_threads):
+    pool = QThreadPool(parent)
+    pool.setMaxThreadCount(max_threads)
+    _thread_pools.add(pool)
+    return pool
+
+def shutdown_thread_pools():
+    for pool in list(_thread_pools):
+        pool.clear()
+        pool.waitForDone()
+
+class FunctionTask(QRunnable):
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+
+    def run(self):
+        try:
+            self.fn(*self.args)
+        except RuntimeError as e:
+            # 終了処理中に結果の受け取り先が先に破棄された場合は捨てる
+            if "has been deleted" not in str(e):
+                raise
+
+# --- 画像の先読み ---
+# 次に表示する画像をスレッドプールでデコード・縮小しておく
+class ImagePrefetcher(QObject):
+    image_ready = pyqtSignal(int, str, QImage, QImage)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thread_pool = create_thread_pool(self, 2)
+        self.generation = 0
+        self.pending = set()  # 要求中のパス。デコードが済んだものは image_cache の ("prefetch", path) に入る
+        self.image_ready.connect(self.on_image_ready)
+
+    def reset(self):
+        self.generation += 1
+        for path in self.pending:
+            image_cache.discard(("prefetch", path))
+        self.pending.clear()
 
-    def load_stats(self):
-        if os.path.exists(STATS_FILE):
-            try:
-                with open(STATS_FILE, 'r', encoding='utf-8') as f:
-                    self.stats = json.load(f)
-            except:
-                self.stats = {}
+    def request(self, path, decode_size, target_size):
+        if path in self.pending:
+            return
+        self.pending.add(path)
+        self.thread_pool.start(FunctionTask(self.decode, self.generation, path, decode_size, QSize(target_size)))
 
-    def save_stats(self):
-        try:
-            with open(STATS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.stats, f, ensure_ascii=False, indent=2)
-        except:
-            pass
+    def decode(self, generation, path, decode_size, target_size):
+        # ワーカースレッドで実行される
+        image, _ = decode_image(path, decode_size)
+        if image.isNull():
+            library_index.mark_broken(path, "decode failed")
+        scaled = QImage()
+        if not image.isNull() and target_size.width() > 0 and target_size.height() > 0:
+            scaled = image.scaled(target_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+        self.image_ready.emit(generation, path, image, scaled)
 
-    def get_count(self, path):
-        return self.stats.get(path, 0)
+    def on_image_ready(self, generation, path, image, scaled):
+        if generation != self.generation or path not in self.pending:
+            return
+        image_cache.put(("prefetch", path), (image, scaled))
 
-    def increment_count(self, path):
-        self.stats[path] = self.stats.get(path, 0) + 1
-        self.save_stats()
+    def take(self, path):
+        # デコード中やメモリの上限で追い出された場合は None
+        self.pending.discard(path)
+        return image_cache.pop(("prefetch", path))
 
-    def select_next_image(self, image_pool, current_image_path=None):
-        if not image_pool: return None
-        pool_counts = {path: self.get_count(path) for path in image_pool}
-        min_count = min(pool_counts.values())
-        candidates = [path for path, count in pool_counts.items() if count == min_count]
-        
-        if len(candidates) > 1 and current_image_path in candidates:
-            candidates = [p for p in candidates if p != current_image_path]
-        
-        return random.choice(candidates)
+    def discard(self, path):
+        self.pending.discard(path)
+        image_cache.discard(("prefetch", path))
 
-stats_manager = ImageStatsManager()
+    def retain(self, paths):
+        # 先読みの範囲から外れた画像を捨てる
+        keep = set(paths)
+        for path in [p for p in self.pending if p not in keep]:
+            self.discard(path)
 
-# --- 設定管理クラス ---
-class AppConfigManager:
-    def __init__(self):
-        self.config = {
-            "window_size": [1000, 800],
-            "language": "en",
-            "last_preset_data": None,
-            "last_set_name": "Custom",
-            "always_on_top": False,
-            "move_target_folder": "" 
-        }
-        self.load_config()
+# --- 画像の移動 (バックグラウンド) ---
+# 移動は 1 本のワーカースレッドで順番に行い、UI は完了を待たない。
+# 移動先の名前の重複は listdir 1 回で調べる。完了した移動は最近の分だけ元に戻せる
+def unique_destination(target_dir, filename):
+    names = {os.path.normcase(name) for name in os.listdir(target_dir)}
+    base, ext = os.path.splitext(filename)
+    candidate = filename
+    count = 1
+    while os.path.normcase(candidate) in names:
+        candidate = f"{base}_{count}{ext}"
+        count += 1
+    return os.path.join(target_dir, candidate)
 
-    def load_config(self):
-        if os.path.exists(CONFIG_FILE):
+class FileMover(QObject):
+    moved = pyqtSignal(str, str)      # 移動元, 移動先
+    undone = pyqtSignal(str, str)     # 移動先, 戻した場所
+    failed = pyqtSignal(str, str)     # パス, エラー
+    history_changed = pyqtSignal(int) # 元に戻せる移動の数
+    finished_move = pyqtSignal(str, str, str, str, bool)  # 移動元, 移動先, 指紋, エラー, undo か
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thread_pool = create_thread_pool(self, 1)
+        self.history = deque(maxlen=max(1, config_manager.config.get("move_undo_limit", 20)))  # (移動元, 移動先)
+        self.undoing = {}  # 元に戻している途中の移動先 -> (移動元, 移動先)
+        self.finished_move.connect(self.on_finished)
+
+    def move(self, src, target_dir):
+        # 移動先でも表示回数を引き継げるよう、指紋がまだなければワーカーで先に計算する
+        identify = stats_manager.key_for(src) == src
+        self.thread_pool.start(FunctionTask(self.run, src, target_dir, identify, False))
+
+    def undo(self):
+        if not self.history:
+            return
+        src, dst = self.history.pop()
+        self.undoing[dst] = (src, dst)
+        self.history_changed.emit(len(self.history))
+        self.thread_pool.start(FunctionTask(self.run, dst, os.path.dirname(src), False, True, os.path.basename(src)))
+
+    def run(self, src, target_dir, identify, undo, filename=None):
+        # ワーカースレッドで実行される
+        fingerprint = ""
+        if identify:
             try:
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.config.update(data)
-            except:
+                fingerprint = fingerprint_file(src)
+            except OSError:
                 pass
-
-    def save_config(self):
         try:
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=2)
-        except:
-            pass
+            dst = unique_destination(target_dir, filename or os.path.basename(src))
+            shutil.move(src, dst)
+        except (OSError, shutil.Error) as e:
+            self.finished_move.emit(src, "", "", str(e), undo)
+            return
+        library_index.move_file(src, dst)
+        self.finished_move.emit(src, dst, fingerprint, "", undo)
 
-config_manager = AppConfigManager()
+    def on_finished(self, src, dst, fingerprint, error, undo):
+        entry = self.undoing.pop(src, None) if undo else None
+        if error:
+            if entry is not None:
+                # 戻せなかった移動は、もう一度試せるよう履歴に戻す
+                self.history.append(entry)
+                self.history_changed.emit(len(self.history))
+            self.failed.emit(src, error)
+            return
+        if fingerprint:
+            stats_manager.set_identities([(src, fingerprint)])
+        stats_manager.rename_path(src, dst)
+        if undo:
+            self.undone.emit(src, dst)
+        else:
+            self.history.append((src, dst))
+            self.history_changed.emit(len(self.history))
+            self.moved.emit(src, dst)
 
-# --- 共通ヘルパー関数 ---
-def get_image_files(folders):
-    image_paths = []
-    for folder_data in folders:
-        if not folder_data["checked"]: continue
-        path = folder_data["path"]
-        if os.path.isdir(path):
-            for root, _, files in os.walk(path):
-                for file in files:
-                    if os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS:
-                        image_paths.append(os.path.join(root, file))
-    return image_paths
+    def wait(self):
+        # 残っている移動を終わらせ、結果 (統計の更新) もここで受け取る
+        self.thread_pool.waitForDone()
+        QApplication.sendPostedEvents(self)
+
+# --- 表示用の縮小 ---
+# リサイズ中は高速な縮小で追従し、落ち着いてから一度だけ高品質に縮小する。
+# 縮小結果は表示サイズごとに少数キャッシュし、レイアウトの切り替えで作り直さない
+class PixmapScaler(QObject):
+    CACHE_SIZE = 4
+    SETTLE_DELAY = 150  # ms
+
+    def __init__(self, label, size_func=None, parent=None):
+        super().__init__(parent)
+        self.label = label
+        self.size_func = size_func or label.size
+        self.source = QPixmap()
+        self.cache = OrderedDict()  # 縮小後のサイズ -> QPixmap
+        self.settle_timer = QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.timeout.connect(self.update)
+
+    def set_source(self, pixmap, scaled=None):
+        self.source = pixmap
+        self.cache.clear()
+        self.settle_timer.stop()
+        if scaled is not None and not scaled.isNull():
+            self.store(scaled)
+        self.update()
+
+    def clear(self):
+        self.source = QPixmap()
+        self.cache.clear()
+        self.settle_timer.stop()
+        self.label.clear()
+
+    def store(self, scaled):
+        self.cache[(scaled.width(), scaled.height())] = scaled
+        self.cache.move_to_end((scaled.width(), scaled.height()))
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    def fitted_size(self, target):
+        size = self.source.size().scaled(target, Qt.AspectRatioMode.KeepAspectRatio)
+        return (size.width(), size.height())
+
+    @perf.timed("update_image_scale")
+    def update(self, smooth=True):
+        if self.source.isNull():
+            return
+        target = self.size_func()
+        if target.width() <= 0 or target.height() <= 0:
+            return
+        key = self.fitted_size(target)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            self.label.setPixmap(cached)
+            return
+        if smooth:
+            scaled = self.source.scaled(target, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            self.store(scaled)
+        else:
+            scaled = self.source.scaled(target, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.FastTransformation)
+            self.settle_timer.start(self.SETTLE_DELAY)
+        self.label.setPixmap(scaled)
+
+    def resized(self):
+        self.update(smooth=False)
+
+# --- UI部品: 残り時間バー ---
+# スタイルシートを使わずに自前で描画し、塗りの幅か色が変わったときだけ再描画する
+class CountdownBar(QWidget):
+    BORDER = 2
+    COLOR_NORMAL = QColor("#4CAF50")
+    COLOR_WARNING = QColor("#ff4444")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.fraction = 1.0
+        self.warning = False
+        self.setFixedHeight(20)
+        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
+
+    def inner_rect(self):
+        b = self.BORDER
+        return self.rect().adjusted(b, b, -b, -b)
+
+    def fill_width(self, fraction):
+        return round(self.inner_rect().width() * fraction)
+
+    def pixel_duration(self, total):
+        # 塗りが 1px 変わるのにかかる秒数
+        width = max(1, self.inner_rect().width())
+        return total / width
+
+    def set_fraction(self, fraction, warning):
+        fraction = max(0.0, min(1.0, fraction))
+        old_width = self.fill_width(self.fraction)
+        new_width = self.fill_width(fraction)
+        self.fraction = fraction
+        if warning != self.warning:
+            self.warning = warning
+            self.update()
+        elif old_width != new_width:
+            inner = self.inner_rect()
+            left = inner.left() + min(old_width, new_width)
+            self.update(QRect(left - 1, 0, abs(old_width - new_width) + 2, self.height()))
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        inner = self.inner_rect()
+        fill = QRect(inner.left(), inner.top(), self.fill_width(self.fraction), inner.height())
+        painter.fillRect(fill, self.COLOR_WARNING if self.warning else self.COLOR_NORMAL)
+        b = self.BORDER
+        painter.setPen(QPen(QColor("grey"), b))
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        painter.drawRoundedRect(QRectF(self.rect()).adjusted(b / 2, b / 2, -b / 2, -b / 2), 5, 5)
 
 # --- UI部品: ドラッグ＆ドロップ対応リスト ---
 class FolderListWidget(QListWidget):
@@ -375,23 +2838,21 @@ class ConfigWidget(QWidget):
         self.layout.addWidget(self.btn_start)
 
         # Initialization
-        self.load_presets_from_file()
-        last_set_name = config_manager.config.get("last_set_name", "Custom")
-        index = self.combo_presets.findText(last_set_name)
-        if index >= 0:
-            self.combo_presets.setCurrentIndex(index)
-        else:
-            self.combo_presets.setCurrentIndex(0)
-            last_data = config_manager.config.get("last_preset_data")
-            if last_data:
-                self.restore_state(last_data)
+        # 前回の状態 (設定ファイルにある) だけを先に復元する。プリセットのファイルは最初の描画の後に load_presets で読む
+        self.initial_set_name = config_manager.config.get("last_set_name", "Custom")
+        last_data = config_manager.config.get("last_preset_data")
+        if last_data:
+            self.restore_state(last_data)
         
         if self.steps_layout.count() == 1:
             self.add_step_row(10, 30)
             self.add_step_row(10, 60)
             self.add_step_row(5, 180)
 
+        # 「Custom」の表示名の変更で選択中のプリセット名が上書きされないようにする
+        self.combo_presets.blockSignals(True)
         self.update_ui_text()
+        self.combo_presets.blockSignals(False)
         self.update_move_path_label()
 
     def toggle_always_on_top(self):
@@ -558,6 +3019,12 @@ class ConfigWidget(QWidget):
     def save_presets_to_file(self):
         with open(PRESET_FILE, 'w', encoding='utf-8') as f: json.dump(self.presets, f, ensure_ascii=False, indent=2)
 
+    def load_presets(self):
+        self.load_presets_from_file()
+        index = self.combo_presets.findText(self.initial_set_name)
+        if index > 0:
+            self.combo_presets.setCurrentIndex(index)
+
     def load_presets_from_file(self):
         if os.path.exists(PRESET_FILE):
             with open(PRESET_FILE, 'r', encoding='utf-8') as f: self.presets = json.load(f)
@@ -588,12 +3055,16 @@ class ViewerWidget(QWidget):
         info_layout.addWidget(self.lbl_step_info)
         info_layout.addWidget(self.lbl_next_step)
         info_layout.addStretch()
+
+        # 走査の進捗表示 (走査が終わったら隠す)
+        self.lbl_scan = QLabel("")
+        self.lbl_scan.setStyleSheet("color: #AAA; font-size: 12px; margin-right: 10px;")
+        self.lbl_scan.hide()
+        info_layout.addWidget(self.lbl_scan)
         info_layout.addWidget(self.lbl_timer)
         self.layout.addLayout(info_layout)
 
-        self.progress_bar = QProgressBar()
-        self.progress_bar.setTextVisible(False)
-        self.progress_bar.setStyleSheet("QProgressBar { border: 2px solid grey; border-radius: 5px; } QProgressBar::chunk { background-color: #4CAF50; }")
+        self.progress_bar = CountdownBar()
         self.layout.addWidget(self.progress_bar)
 
         self.lbl_image = QLabel()
@@ -601,6 +3072,17 @@ class ViewerWidget(QWidget):
         self.lbl_image.setStyleSheet("background-color: #222;") # 画像エリアはさらに暗く
         self.lbl_image.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         self.layout.addWidget(self.lbl_image, 1)
+        self.scaler = PixmapScaler(self.lbl_image, parent=self)
+
+        # 処理時間のオーバーレイ (F3)
+        self.lbl_perf = QLabel(self.lbl_image)
+        self.lbl_perf.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: #8f8; font-family: monospace; font-size: 11px; padding: 6px;")
+        self.lbl_perf.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.lbl_perf.move(8, 8)
+        self.lbl_perf.hide()
+        self.perf_timer = QTimer(self)
+        self.perf_timer.setInterval(1000)
+        self.perf_timer.timeout.connect(self.update_perf_overlay)
 
         control_layout = QHBoxLayout()
         self.btn_pause = QPushButton()
@@ -625,22 +3107,42 @@ class ViewerWidget(QWidget):
         control_layout.addWidget(self.btn_stop)
         self.layout.addLayout(control_layout)
 
+        # 残り時間は単調増加クロックの締め切りから求める (タイマーの遅れで延びない)。
+        # タイマーは次に表示が変わる時刻に合わせて 1 回ずつ張り直す
         self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
         self.timer.timeout.connect(self.tick)
         
         self.folders = []
         self.steps = []
-        self.image_pool = []
-        self.history = []
-        self.skipped_history = []
-        self.current_step_index = 0
-        self.images_done_in_step = 0
-        self.time_left = 0
-        self.total_step_time = 0
+        self.scanner = None
+        self.scan_done = False
+        self.session_started = False
+        self.waiting_for_images = False
+        self.engine = SessionEngine([], self.create_pool())
+        self.pending_beeps = []
+        self.timer_text = ""
         self.is_paused = False
-        self.current_image_path = ""
+
+        # 先読み
+        self.prefetcher = ImagePrefetcher(self)
+
+        # 画像の移動
+        self.file_mover = FileMover(self)
+        self.file_mover.moved.connect(self.on_move_finished)
+        self.file_mover.failed.connect(self.on_move_failed)
+
+        # 似た画像のグループ分け
+        self.phash_indexer = PerceptualIndexer(self)
+        self.phash_indexer.clusters_ready.connect(self.on_clusters_ready)
+
+        # セッション中のフォルダの変更
+        self.library_watcher = LibraryWatcher(self)
+        self.library_watcher.changes_ready.connect(self.on_library_changed)
         
         self.update_ui_text()
+        self.set_perf_overlay(config_manager.config.get("perf_overlay", False))
 
     def update_ui_text(self):
         lang = self.current_lang
@@ -648,34 +3150,142 @@ class ViewerWidget(QWidget):
         self.btn_move.setText(TEXTS["btn_move"][lang])
         self.btn_skip.setText(TEXTS["btn_skip"][lang])
         self.btn_stop.setText(TEXTS["btn_stop"][lang])
-        if not self.history and not self.image_pool:
+        if not self.engine.history and not self.engine.pool:
              self.lbl_image.setText(TEXTS["loading"][lang])
 
+    def create_pool(self):
+        config = config_manager.config
+        return stats_manager.create_pool(policy=config.get("selection_policy", "min_count"),
+                                         weights=config.get("selection_weights"))
+
     def start_session(self, folders, steps, lang):
         self.current_lang = lang
         self.update_ui_text()
         
         self.folders = folders
         self.steps = steps
-        self.image_pool = get_image_files(folders)
-        self.history = []
-        self.skipped_history = []
-        self.current_step_index = 0
-        self.images_done_in_step = 0
+        perf.reset()
+        # 起動時にバックグラウンドで読み込み中なら、ここで終わるのを待つ
+        stats_manager.ensure_loaded()
+        self.engine = SessionEngine(steps, self.create_pool())
         self.is_paused = False
-        
-        if not self.image_pool:
-            QMessageBox.critical(self, TEXTS["msg_error"][lang], TEXTS["msg_no_img"][lang])
-            self.finished.emit([], [])
-            return
+        self.session_started = False
+        self.waiting_for_images = False
+        self.scan_done = False
+        self.prefetcher.reset()
 
+        self.lbl_image.clear()
+        self.lbl_image.setText(TEXTS["loading"][lang])
+        self.lbl_scan.setText(TEXTS["scanning"][lang].format(0))
+        self.lbl_scan.show()
         self.setFocus()
+
+        # 走査はバックグラウンドで行い、数枚見つかった時点で開始する
+        self.stop_scan()
+        self.scanner = FolderScanner(self)
+        self.scanner.files_found.connect(self.on_files_found)
+        self.scanner.identities_found.connect(self.on_identities_found)
+        self.scanner.scan_finished.connect(self.on_scan_finished)
+        self.scanner.start(folders)
+
+    def stop_scan(self):
+        if self.scanner is not None:
+            self.scanner.cancel()
+            self.scanner = None
+        self.phash_indexer.cancel()
+        self.library_watcher.stop()
+
+    def on_files_found(self, paths):
+        if self.sender() is not self.scanner:
+            return
+        self.engine.pool.extend(paths)
+        self.lbl_scan.setText(TEXTS["scanning"][self.current_lang].format(len(self.engine.pool)))
+
+        if not self.session_started and len(self.engine.pool) >= SCAN_START_THRESHOLD:
+            self.begin_session()
+        elif self.waiting_for_images:
+            self.waiting_for_images = False
+            self.load_next_image()
+
+    def on_identities_found(self, identities):
+        if self.sender() is not self.scanner:
+            return
+        # 同じ内容のファイルはプールの中で 1 枚にまとまる
+        stats_manager.set_identities(identities)
+        if not self.scan_done:
+            self.lbl_scan.setText(TEXTS["scanning"][self.current_lang].format(len(self.engine.pool)))
+
+    def on_scan_finished(self, total):
+        if self.sender() is not self.scanner:
+            return
+        self.scan_done = True
+        self.lbl_scan.hide()
+        self.report_broken(self.scanner.broken)
+        self.start_phash_indexer()
+        self.library_watcher.start(self.checked_roots())
+
+        if not self.session_started:
+            if not self.engine.pool:
+                lang = self.current_lang
+                QMessageBox.critical(self, TEXTS["msg_error"][lang], TEXTS["msg_no_img"][lang])
+                self.finished.emit([], [])
+                return
+            self.begin_session()
+        elif self.waiting_for_images:
+            self.waiting_for_images = False
+            self.load_next_image()
+        else:
+            # 走査中は数枚先までしか選んでいないので、残りの予定をここでまとめて作る
+            self.fill_upcoming()
+
+    def checked_roots(self):
+        return [f["path"] for f in self.folders if f["checked"] and os.path.isdir(f["path"])]
+
+    def on_library_changed(self, added, removed, identities):
+        for path in removed:
+            self.engine.reject(path)
+            self.prefetcher.discard(path)
+        if added:
+            self.engine.pool.extend(added)
+            stats_manager.set_identities(identities)
+        if self.waiting_for_images and self.engine.pool:
+            self.waiting_for_images = False
+            self.load_next_image()
+        elif self.session_started and (added or removed):
+            # 予定表から消えた分を選び直し、先読みと次の画像の表示を合わせる
+            self.fill_upcoming()
+
+    def start_phash_indexer(self):
+        distance = config_manager.config.get("near_duplicate_distance", 4)
+        if distance <= 0 or len(self.engine.pool) < 2:
+            return
+        self.phash_indexer.start(self.checked_roots(), self.engine.pool.paths(), min(distance, 63))
+
+    def on_clusters_ready(self, generation, clusters):
+        if generation != self.phash_indexer.generation:
+            return
+        stats_manager.set_clusters(clusters)
+
+    def report_broken(self, broken):
+        if not broken:
+            return
+        write_broken_report(broken)
+        self.lbl_scan.setText(TEXTS["broken_skipped"][self.current_lang].format(len(broken), BROKEN_REPORT_FILE))
+        self.lbl_scan.show()
+        QTimer.singleShot(8000, self.hide_status_message)
+
+    def hide_status_message(self):
+        if self.scan_done:
+            self.lbl_scan.hide()
+
+    def begin_session(self):
+        self.session_started = True
         self.start_step()
 
     def update_status_label(self):
-        step = self.steps[self.current_step_index]
+        step = self.engine.step
         count_str = str(step['count'])
-        current_img_num = self.images_done_in_step + 1
+        current_img_num = self.engine.done_in_step + 1
         
         if step['count'] == 0:
             # 無限モード
@@ -687,99 +3297,133 @@ class ViewerWidget(QWidget):
             self.lbl_step_info.setText(fmt.format(step['duration'], current_img_num, count_str))
 
     def start_step(self):
-        if self.current_step_index >= len(self.steps):
+        if self.engine.is_finished():
             self.finish_session()
             return
 
-        step = self.steps[self.current_step_index]
-        self.images_done_in_step = 0
-        
         # 現在のステップ表示更新
         self.update_status_label()
         
-        # 次のステップ表示
-        next_idx = self.current_step_index + 1
-        if next_idx < len(self.steps):
-            next_step = self.steps[next_idx]
+        self.load_next_image()
+
+    def update_next_label(self):
+        # 次のステップと、予定表の次の画像
+        next_step = self.engine.next_step
+        if next_step is not None:
             next_fmt = TEXTS["next_fmt"][self.current_lang]
             next_count_str = str(next_step['count']) if next_step['count'] > 0 else "∞"
-            self.lbl_next_step.setText(next_fmt.format(next_step['duration'], next_count_str))
+            text = next_fmt.format(next_step['duration'], next_count_str)
         else:
-            self.lbl_next_step.setText(TEXTS["next_finish"][self.current_lang])
+            text = TEXTS["next_finish"][self.current_lang]
+        if self.engine.upcoming:
+            text += TEXTS["next_image"][self.current_lang].format(os.path.basename(self.engine.upcoming[0]))
+        self.lbl_next_step.setText(text)
 
-        self.load_next_image()
+    def fill_upcoming(self):
+        # 予定表の先頭 prefetch_depth 枚だけ先読みする
+        depth = max(1, config_manager.config.get("prefetch_depth", 3))
+        window = self.engine.fill_upcoming(depth, self.scan_done)[:depth]
+        self.prefetcher.retain(window)
+        decode_size = display_size(self)
+        for path in window:
+            self.prefetcher.request(path, decode_size, self.lbl_image.size())
+        self.update_next_label()
 
+    @perf.timed("load_next_image")
     def load_next_image(self):
-        if not self.image_pool:
-            self.finish_session()
-            return
+        while True:
+            next_path = self.engine.take_next()
+            if next_path is None:
+                if self.scan_done:
+                    self.finish_session()
+                else:
+                    # 走査中ならプールが増えるのを待つ
+                    self.waiting_for_images = True
+                return
 
-        next_path = stats_manager.select_next_image(self.image_pool, self.current_image_path)
-        self.current_image_path = next_path
-        
-        pixmap = QPixmap(self.current_image_path)
-        if pixmap.isNull():
-            if self.current_image_path in self.image_pool:
-                self.image_pool.remove(self.current_image_path)
-            self.load_next_image()
-            return
+            frame = self.prefetcher.take(next_path)
+            if frame is None:
+                # 先読みが間に合わなかった場合はその場でデコードする
+                frame = (decode_image(next_path, display_size(self))[0], QImage())
+                if frame[0].isNull():
+                    library_index.mark_broken(next_path, "decode failed")
+            image, scaled = frame
+            if not image.isNull():
+                break
+            self.engine.reject(next_path)
 
-        self.current_pixmap = pixmap
-        self.update_image_scale()
-        
-        step = self.steps[self.current_step_index]
-        self.total_step_time = step['duration'] * 10
-        self.time_left = self.total_step_time
-        
-        self.progress_bar.setStyleSheet("QProgressBar { border: 2px solid grey; border-radius: 5px; } QProgressBar::chunk { background-color: #4CAF50; }") 
-        self.progress_bar.setMaximum(self.time_left)
-        self.progress_bar.setValue(self.time_left)
-        self.update_timer_display()
-        self.timer.start(100)
-
-    def update_image_scale(self):
-        if hasattr(self, 'current_pixmap') and not self.current_pixmap.isNull():
-            w = self.lbl_image.width()
-            h = self.lbl_image.height()
-            if w > 0 and h > 0:
-                scaled = self.current_pixmap.scaled(w, h, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-                self.lbl_image.setPixmap(scaled)
+        # 表示中の画像もメモリの上限に数える
+        image_cache.discard(("view", self.engine.current))
+        self.current_pixmap = QPixmap.fromImage(image)
+        image_cache.put(("view", next_path), self.current_pixmap)
+        self.scaler.set_source(self.current_pixmap, QPixmap.fromImage(scaled))
+        self.engine.show(next_path, self.is_paused)
+        self.fill_upcoming()
+        self.start_countdown()
+        self.update_perf_overlay()
+
+    def start_countdown(self):
+        duration = self.engine.duration
+        self.pending_beeps = [b for b in BEEP_SECONDS if b < duration]
+        self.progress_bar.set_fraction(1.0, False)
+        self.update_timer_display(duration)
+        self.timer.stop()
+        if not self.is_paused:
+            self.schedule_tick(duration)
+
+    def stop_clock(self):
+        self.engine.pause()
+        self.timer.stop()
+
+    def resume_clock(self):
+        self.engine.resume()
+        self.schedule_tick(self.engine.remaining())
+
+    def schedule_tick(self, remaining):
+        # 次に「秒表示が変わる」「バーが 1px 動く」「ビープを鳴らす」のうち一番早い時刻まで眠る
+        until_second = remaining - math.floor(remaining - 1e-6) if remaining > 0 else 0.0
+        until_pixel = max(TICK_MIN_INTERVAL, self.progress_bar.pixel_duration(self.engine.duration))
+        next_event = min(until_second, until_pixel, TICK_MAX_INTERVAL)
+        if self.pending_beeps:
+            next_event = min(next_event, remaining - self.pending_beeps[0])
+        self.timer.start(max(10, int(next_event * 1000) + 1))
 
     def resizeEvent(self, event):
-        self.update_image_scale()
+        self.scaler.resized()
         super().resizeEvent(event)
 
     def tick(self):
-        if self.time_left > 0:
-            self.time_left -= 1
-            self.progress_bar.setValue(self.time_left)
-            self.update_timer_display()
-            
-            if self.time_left / self.total_step_time <= 0.1:
-                 self.progress_bar.setStyleSheet("QProgressBar { border: 2px solid grey; border-radius: 5px; } QProgressBar::chunk { background-color: #ff4444; }")
-            
-            if self.time_left in [30, 20, 10]:
-                QApplication.beep()
-                
-        else:
+        # 画像がまだ表示されていなければ何も数えない
+        if self.engine.current is None:
+            return
+        remaining = self.engine.remaining()
+        if remaining <= 0:
             self.image_finished()
+            return
+
+        fraction = remaining / self.engine.duration
+        self.progress_bar.set_fraction(fraction, fraction <= 0.1)
+        self.update_timer_display(remaining)
+
+        if self.pending_beeps and remaining <= self.pending_beeps[0]:
+            self.pending_beeps.pop(0)
+            QApplication.beep()
+
+        self.schedule_tick(remaining)
 
-    def update_timer_display(self):
-        total_sec = (self.time_left // 10) + 1
+    def update_timer_display(self, remaining):
+        total_sec = math.ceil(remaining)
         mins, secs = divmod(total_sec, 60)
-        self.lbl_timer.setText(f"{mins:02d}:{secs:02d} ({total_sec}s)")
+        text = f"{mins:02d}:{secs:02d} ({total_sec}s)"
+        if text != self.timer_text:
+            self.timer_text = text
+            self.lbl_timer.setText(text)
 
     def image_finished(self):
         self.timer.stop()
-        self.history.append(self.current_image_path)
-        stats_manager.increment_count(self.current_image_path)
-        
-        self.images_done_in_step += 1
-        step = self.steps[self.current_step_index]
         
         # 完了チェック
-        if step['count'] > 0 and self.images_done_in_step >= step['count']:
-            self.current_step_index += 1
+        if self.engine.complete_current():
             self.start_step()
         else:
             # まだこのステップが続くなら、枚数表示を更新して次へ
@@ -787,12 +3431,17 @@ class ViewerWidget(QWidget):
             self.load_next_image()
 
     def skip_image(self):
+        if not self.session_started: return
         self.timer.stop()
-        self.skipped_history.append(self.current_image_path)
+        self.engine.skip_current()
         self.load_next_image()
 
     def move_and_skip(self):
-        self.timer.stop()
+        if not self.session_started: return
+        if self.engine.current is not None and is_archive_member(self.engine.current):
+            self.flash_message(TEXTS["move_archive"][self.current_lang])
+            return
+        self.stop_clock()
         target_dir = config_manager.config.get("move_target_folder")
         
         if not target_dir or not os.path.isdir(target_dir):
@@ -801,92 +3450,314 @@ class ViewerWidget(QWidget):
                 config_manager.config["move_target_folder"] = target_dir
                 config_manager.save_config()
             else:
-                self.timer.start()
+                if not self.is_paused: self.resume_clock()
                 return
 
-        src = self.current_image_path
-        filename = os.path.basename(src)
-        dst = os.path.join(target_dir, filename)
-        
-        try:
-            if os.path.exists(dst):
-                base, ext = os.path.splitext(filename)
-                count = 1
-                while os.path.exists(dst):
-                    dst = os.path.join(target_dir, f"{base}_{count}{ext}")
-                    count += 1
-            
-            shutil.move(src, dst)
-            
-            if src in self.image_pool:
-                self.image_pool.remove(src)
-            
-            self.skipped_history.append(dst)
-            self.load_next_image()
-            
-        except Exception as e:
-            QMessageBox.critical(self, TEXTS["msg_error"][self.current_lang], str(e))
-            self.timer.start()
+        # 移動はバックグラウンドで行い、すぐ次の画像へ進む
+        src = self.engine.current
+        self.engine.moved_current()
+        self.file_mover.move(src, target_dir)
+        self.load_next_image()
+
+    def on_move_finished(self, src, dst):
+        self.engine.move_finished(src, dst)
+
+    def on_move_failed(self, src, error):
+        self.engine.move_failed(src)
+
+    def toggle_pin(self):
+        if not self.session_started or self.engine.current is None: return
+        pinned = stats_manager.flag_of(stats_manager.key_for(self.engine.current)) == ImageStatsManager.PINNED
+        stats_manager.set_flag(self.engine.current, 0 if pinned else ImageStatsManager.PINNED)
+        self.flash_message(TEXTS["flag_unpinned" if pinned else "flag_pinned"][self.current_lang])
+
+    def ban_image(self):
+        # 今の画像を今後のセッションから外して次へ進む
+        if not self.session_started or self.engine.current is None: return
+        stats_manager.set_flag(self.engine.current, ImageStatsManager.BANNED)
+        self.flash_message(TEXTS["flag_banned"][self.current_lang])
+        self.skip_image()
+
+    def flash_message(self, text):
+        self.lbl_scan.setText(text)
+        self.lbl_scan.show()
+        QTimer.singleShot(2000, self.hide_status_message)
 
     def toggle_pause(self):
+        if not self.session_started: return
         if self.is_paused:
-            self.timer.start()
+            self.resume_clock()
             self.is_paused = False
             self.lbl_timer.setStyleSheet("font-size: 24px; font-weight: bold; color: white;")
         else:
-            self.timer.stop()
+            self.stop_clock()
             self.is_paused = True
             self.lbl_timer.setStyleSheet("font-size: 24px; font-weight: bold; color: red;")
 
     def stop_session(self):
         self.timer.stop()
-        self.finished.emit(self.history, self.skipped_history)
+        self.stop_scan()
+        self.engine.finish()
+        self.release_images()
+        self.write_perf_log()
+        self.finished.emit(self.engine.history, self.engine.skipped)
 
     def finish_session(self):
         self.timer.stop()
-        self.finished.emit(self.history, self.skipped_history)
+        self.stop_scan()
+        self.engine.finish()
+        self.release_images()
+        self.write_perf_log()
+        self.finished.emit(self.engine.history, self.engine.skipped)
+
+    def release_images(self):
+        # 先読みと表示中の画像を手放す (次のセッションまで持ち越さない)
+        self.prefetcher.reset()
+        image_cache.discard(("view", self.engine.current))
+        self.current_pixmap = QPixmap()
+        self.scaler.clear()
+
+    def write_perf_log(self):
+        if config_manager.config.get("perf_log", True):
+            perf.dump(images=len(self.engine.history), skipped=len(self.engine.skipped), library=len(self.engine.pool))
+
+    def set_perf_overlay(self, visible):
+        self.lbl_perf.setVisible(visible)
+        if visible:
+            self.update_perf_overlay()
+            self.perf_timer.start()
+        else:
+            self.perf_timer.stop()
+
+    def toggle_perf_overlay(self):
+        visible = not self.lbl_perf.isVisible()
+        config_manager.config["perf_overlay"] = visible
+        self.set_perf_overlay(visible)
+
+    def update_perf_overlay(self):
+        if not self.lbl_perf.isVisible():
+            return
+        lines = [TEXTS["perf_title"][self.current_lang]] + perf.summary_lines() + [image_cache.summary()]
+        self.lbl_perf.setText("\n".join(lines))
+        self.lbl_perf.adjustSize()
+        self.lbl_perf.raise_()
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key.Key_Space:
             self.toggle_pause()
         elif event.key() == Qt.Key.Key_S:
             self.skip_image()
+        elif event.key() == Qt.Key.Key_P:
+            self.toggle_pin()
+        elif event.key() == Qt.Key.Key_B:
+            self.ban_image()
+        elif event.key() == Qt.Key.Key_F3:
+            self.toggle_perf_overlay()
         elif event.key() == Qt.Key.Key_Escape:
             self.stop_session()
 
 class ReviewWidget(QWidget):
     clicked = pyqtSignal()
+    image_decoded = pyqtSignal(str, QImage)
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.layout = QVBoxLayout(self)
         self.layout.setContentsMargins(0, 0, 0, 0)
+        self.layout.setSpacing(0)
+        self.lbl_position = QLabel()
+        self.lbl_position.setStyleSheet("background-color: #000; color: #AAA; padding: 4px;")
+        self.layout.addWidget(self.lbl_position)
         self.lbl_image = QLabel()
         self.lbl_image.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.lbl_image.setStyleSheet("background-color: #000;")
-        self.layout.addWidget(self.lbl_image)
+        self.lbl_image.setStyleSheet("background-color: #000; color: #AAA;")
+        self.layout.addWidget(self.lbl_image, 1)
+        self.scaler = PixmapScaler(self.lbl_image, self.size, parent=self)
+        self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+
+        self.current_lang = "en"
+        self.paths = []
+        self.index = 0
+        # 前後の画像はバックグラウンドで読み込み、image_cache の ("review", path) に置く
+        self.in_flight = set()
+        self.thread_pool = create_thread_pool(self, 2)
+        self.image_decoded.connect(self.on_image_decoded)
+
+    def show_sequence(self, paths, index):
+        self.paths = paths
+        self.show_index(index)
+
+    def show_index(self, index):
+        if not self.paths:
+            return
+        self.index = max(0, min(index, len(self.paths) - 1))
+        path = self.paths[self.index]
+        pixmap = image_cache.get(("review", path))
+        if pixmap is None:
+            image, _ = decode_image(path, display_size(self))
+            pixmap = QPixmap.fromImage(image)
+            if not pixmap.isNull():
+                image_cache.put(("review", path), pixmap)
+        self.current_pixmap = pixmap
+        if pixmap.isNull():
+            # 前の画像を残すと別の画像の番号と取り違えるので、読めなかったことを表示する
+            self.scaler.clear()
+            self.lbl_image.setText(TEXTS["review_load_failed"][self.current_lang].format(os.path.basename(path)))
+        else:
+            self.scaler.set_source(self.current_pixmap)
+        self.update_position_label()
+        self.prefetch_neighbours()
+
+    def update_position_label(self):
+        lang = self.current_lang
+        text = TEXTS["review_pos"][lang].format(self.index + 1, len(self.paths)) + TEXTS["review_flags"][lang]
+        flag = stats_manager.flag_of(stats_manager.key_for(self.paths[self.index]))
+        if flag == ImageStatsManager.PINNED:
+            text = "📌 " + text
+        elif flag == ImageStatsManager.BANNED:
+            text = "🚫 " + text
+        self.lbl_position.setText(text)
 
-    def show_image(self, path):
-        pixmap = QPixmap(path)
-        if not pixmap.isNull():
-            self.current_pixmap = pixmap
-            self.update_scale()
+    def toggle_flag(self, flag):
+        if not self.paths:
+            return
+        path = self.paths[self.index]
+        current = stats_manager.flag_of(stats_manager.key_for(path))
+        stats_manager.set_flag(path, 0 if current == flag else flag)
+        self.update_position_label()
+
+    def prefetch_neighbours(self):
+        size = display_size(self)
+        for offset in (1, -1, 2):
+            i = self.index + offset
+            if not 0 <= i < len(self.paths):
+                continue
+            path = self.paths[i]
+            if ("review", path) in image_cache or path in self.in_flight:
+                continue
+            self.in_flight.add(path)
+            self.thread_pool.start(FunctionTask(self.decode, path, size))
+
+    def decode(self, path, size):
+        # ワーカースレッドで実行される
+        image, _ = decode_image(path, size)
+        self.image_decoded.emit(path, image)
+
+    def on_image_decoded(self, path, image):
+        self.in_flight.discard(path)
+        if not image.isNull():
+            image_cache.put(("review", path), QPixmap.fromImage(image))
 
-    def update_scale(self):
-        if hasattr(self, 'current_pixmap'):
-            scaled = self.current_pixmap.scaled(self.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-            self.lbl_image.setPixmap(scaled)
+    def keyPressEvent(self, event):
+        key = event.key()
+        if key in (Qt.Key.Key_Right, Qt.Key.Key_Down, Qt.Key.Key_PageDown):
+            self.show_index(self.index + 1)
+        elif key in (Qt.Key.Key_Left, Qt.Key.Key_Up, Qt.Key.Key_PageUp):
+            self.show_index(self.index - 1)
+        elif key == Qt.Key.Key_Home:
+            self.show_index(0)
+        elif key == Qt.Key.Key_End:
+            self.show_index(len(self.paths) - 1)
+        elif key == Qt.Key.Key_P:
+            self.toggle_flag(ImageStatsManager.PINNED)
+        elif key == Qt.Key.Key_B:
+            self.toggle_flag(ImageStatsManager.BANNED)
+        elif key == Qt.Key.Key_Escape:
+            self.clicked.emit()
+        else:
+            super().keyPressEvent(event)
 
     def resizeEvent(self, event):
-        self.update_scale()
+        self.scaler.resized()
         super().resizeEvent(event)
 
     def mousePressEvent(self, event):
         self.clicked.emit()
 
+# サムネイルをスレッドプールで並列に作る。結果は loaded で UI スレッドに戻す
+class ThumbnailLoader(QObject):
+    loaded = pyqtSignal(int, int, QImage)  # モデルの番号, 行, 画像
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thread_pool = create_thread_pool(self, max(2, QThread.idealThreadCount()))
+        self.priority = itertools.count()
+
+    def submit(self, key, row, path):
+        # 後から要求された (= 今見えている) 行を先に処理する
+        priority = next(self.priority) % 0x7fffffff
+        self.thread_pool.start(FunctionTask(self.load, key, row, path), priority)
+
+    def load(self, key, row, path):
+        # ワーカースレッドで実行される
+        self.loaded.emit(key, row, thumbnail_cache.load(path))
+
+    def cancel_pending(self):
+        self.thread_pool.clear()
+
+# 見えている行のサムネイルだけを読み込むモデル。
+# 読み込んだサムネイルは image_cache の ("thumb", path) に置くので、追い出されたらまた読み込む
+class ThumbnailModel(QAbstractListModel):
+    keys = itertools.count()
+
+    def __init__(self, paths, loader, parent=None):
+        super().__init__(parent)
+        self.paths = paths
+        self.loader = loader
+        self.key = next(self.keys)
+        self.requested = set()  # 読み込み中の行
+        self.failed = set()     # 読み込めなかった行
+        self.placeholder = QPixmap(THUMB_SIZE - 10, THUMB_SIZE - 10)
+        self.placeholder.fill(QColor("#eee"))
+        self.loader.loaded.connect(self.on_loaded)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.ItemDataRole.DecorationRole:
+            pixmap = image_cache.get(("thumb", self.paths[row]))
+            if pixmap is None:
+                if row not in self.failed:
+                    self.request(row)
+                return self.placeholder
+            return pixmap
+        if role in (Qt.ItemDataRole.UserRole, Qt.ItemDataRole.ToolTipRole):
+            return self.paths[row]
+        return None
+
+    def request(self, row):
+        if row in self.requested:
+            return
+        self.requested.add(row)
+        self.loader.submit(self.key, row, self.paths[row])
+
+    def replace_path(self, old, new):
+        for row, path in enumerate(self.paths):
+            if path == old:
+                self.paths[row] = new
+                self.failed.discard(row)
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def on_loaded(self, key, row, image):
+        if key != self.key:
+            return
+        self.requested.discard(row)
+        if image.isNull():
+            self.failed.add(row)
+        else:
+            image_cache.put(("thumb", self.paths[row]), QPixmap.fromImage(image))
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
 class ResultWidget(QWidget):
     back_requested = pyqtSignal()
-    review_requested = pyqtSignal(str)
+    review_requested = pyqtSignal(list, int)
+    undo_requested = pyqtSignal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -899,65 +3770,119 @@ class ResultWidget(QWidget):
         self.layout.addWidget(self.lbl_hint)
 
         self.tabs = QTabWidget()
+        self.tabs.currentChanged.connect(self.build_tab)
         self.layout.addWidget(self.tabs)
+        self.tab_paths = []
+        self.models = []
+        self.loader = ThumbnailLoader(self)
 
+        # 移動の失敗などのお知らせ (ダイアログは出さない)
+        self.lbl_notice = QLabel()
+        self.lbl_notice.setStyleSheet("color: #c62828;")
+        self.lbl_notice.setWordWrap(True)
+        self.lbl_notice.hide()
+        self.layout.addWidget(self.lbl_notice)
+
+        buttons = QHBoxLayout()
+        self.undo_count = 0
+        self.btn_undo = QPushButton()
+        self.btn_undo.setEnabled(False)
+        self.btn_undo.clicked.connect(self.undo_requested.emit)
+        buttons.addWidget(self.btn_undo)
         self.btn_back = QPushButton()
         self.btn_back.clicked.connect(self.back_requested.emit)
-        self.layout.addWidget(self.btn_back)
+        buttons.addWidget(self.btn_back, 1)
+        self.layout.addLayout(buttons)
 
+    @perf.timed("create_thumbnail_grid")
     def create_thumbnail_grid(self, paths):
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        container = QWidget()
-        grid = QGridLayout(container)
-        grid.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
-        
-        row, col = 0, 0
-        max_cols = 4
-        
-        for path in paths:
-            if not os.path.exists(path): continue
-            
-            btn = QPushButton()
-            btn.setFixedSize(200, 200)
-            btn.setStyleSheet("border: none; background-color: #eee;")
-            
-            reader = QImageReader(path)
-            if reader.size().width() > 200:
-                reader.setScaledSize(QSize(200, 200))
-            img = reader.read()
-            
-            if not img.isNull():
-                icon = QIcon(QPixmap.fromImage(img))
-                btn.setIcon(icon)
-                btn.setIconSize(QSize(190, 190))
-                btn.clicked.connect(lambda checked, p=path: self.review_requested.emit(p))
-                
-                grid.addWidget(btn, row, col)
-                col += 1
-                if col >= max_cols:
-                    col = 0
-                    row += 1
-        
-        scroll.setWidget(container)
-        return scroll
+        view = QListView()
+        view.setViewMode(QListView.ViewMode.IconMode)
+        view.setMovement(QListView.Movement.Static)
+        view.setResizeMode(QListView.ResizeMode.Adjust)
+        view.setUniformItemSizes(True)
+        view.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        view.setIconSize(QSize(THUMB_SIZE - 10, THUMB_SIZE - 10))
+        view.setGridSize(QSize(THUMB_SIZE + 10, THUMB_SIZE + 10))
+        view.setSpacing(5)
+        view.setModel(ThumbnailModel([p for p in paths if image_exists(p)], self.loader, view))
+        view.clicked.connect(lambda index: self.review_requested.emit(index.model().paths, index.row()))
+        return view
 
     def set_results(self, history, skipped, lang):
         self.current_lang = lang
         self.update_ui_text()
         
         self.lbl_msg.setText(TEXTS["result_stats"][lang].format(len(history), len(skipped)))
+        self.lbl_notice.hide()
         
-        self.tabs.clear()
-        self.tabs.addTab(self.create_thumbnail_grid(history), TEXTS["tab_completed"][lang])
-        self.tabs.addTab(self.create_thumbnail_grid(skipped), TEXTS["tab_skipped"][lang])
+        # タブの中身は最初に表示されたときに作る
+        self.loader.cancel_pending()
+        self.tabs.blockSignals(True)
+        while self.tabs.count():
+            page = self.tabs.widget(0)
+            self.tabs.removeTab(0)
+            page.deleteLater()
+        self.tab_paths = [list(history), list(skipped)]
+        self.models = []
+        for key in ("tab_completed", "tab_skipped"):
+            page = QWidget()
+            QVBoxLayout(page).setContentsMargins(0, 0, 0, 0)
+            self.tabs.addTab(page, TEXTS[key][lang])
+        self.tabs.setCurrentIndex(0)
+        self.tabs.blockSignals(False)
+        self.build_tab(0)
+
+    def build_tab(self, index):
+        page = self.tabs.widget(index)
+        if page is None or page.layout().count() > 0:
+            return
+        view = self.create_thumbnail_grid(self.tab_paths[index])
+        self.models.append(view.model())
+        page.layout().addWidget(view)
+
+    def replace_path(self, old, new):
+        # バックグラウンドの移動 (と、その取り消し) が終わったパスを付け替える
+        for paths in self.tab_paths:
+            for i, path in enumerate(paths):
+                if path == old:
+                    paths[i] = new
+        for model in self.models:
+            model.replace_path(old, new)
+
+    def set_undo_count(self, count):
+        self.undo_count = count
+        self.btn_undo.setEnabled(count > 0)
+        self.btn_undo.setText(TEXTS["btn_undo_move"][self.current_lang].format(count))
+
+    def show_notice(self, text):
+        self.lbl_notice.setText(text)
+        self.lbl_notice.show()
 
     def update_ui_text(self):
         lang = self.current_lang
         self.lbl_hint.setText(TEXTS["result_hint"][lang])
         self.btn_back.setText(TEXTS["btn_back_config"][lang])
+        self.btn_undo.setText(TEXTS["btn_undo_move"][lang].format(self.undo_count))
+
+# 最初の描画が終わったことを知らせる (重い初期化はその後に回す)
+class FirstPaintWatcher(QObject):
+    painted = pyqtSignal()
+
+    def __init__(self, widget):
+        super().__init__(widget)
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint:
+            obj.removeEventFilter(self)
+            # 描画が終わってから動かす
+            QTimer.singleShot(0, self.painted.emit)
+        return False
 
 class MainWindow(QMainWindow):
+    first_painted = pyqtSignal()
+
     def __init__(self):
         super().__init__()
         
@@ -997,6 +3922,24 @@ class MainWindow(QMainWindow):
         self.result_screen.review_requested.connect(self.go_to_review)
         self.review_screen.clicked.connect(self.back_to_result)
 
+        # 画像の移動はセッションが終わっても続くので、結果はリザルト画面にも反映する
+        file_mover = self.viewer_screen.file_mover
+        file_mover.moved.connect(self.result_screen.replace_path)
+        file_mover.undone.connect(self.result_screen.replace_path)
+        file_mover.failed.connect(self.on_move_failed)
+        file_mover.history_changed.connect(self.result_screen.set_undo_count)
+        self.result_screen.undo_requested.connect(file_mover.undo)
+
+        self.first_paint_watcher = FirstPaintWatcher(self.config_screen)
+        self.first_paint_watcher.painted.connect(self.on_first_paint)
+
+    def on_first_paint(self):
+        startup_times["first_paint"] = time.perf_counter() - STARTUP_T0
+        self.config_screen.load_presets()
+        startup_times["presets"] = time.perf_counter() - STARTUP_T0
+        stats_manager.load_in_background()
+        self.first_painted.emit()
+
     def toggle_always_on_top(self, checked):
         if checked:
             self.setWindowFlags(self.windowFlags() | Qt.WindowType.WindowStaysOnTopHint)
@@ -1018,9 +3961,18 @@ class MainWindow(QMainWindow):
         self.result_screen.set_results(history, skipped, self.config_screen.current_lang)
         self.stack.setCurrentIndex(2)
 
-    def go_to_review(self, path):
-        self.review_screen.show_image(path)
+    def go_to_review(self, paths, index):
+        self.review_screen.current_lang = self.config_screen.current_lang
+        self.review_screen.show_sequence(paths, index)
         self.stack.setCurrentIndex(3)
+        self.review_screen.setFocus()
+
+    def on_move_failed(self, path, error):
+        text = TEXTS["move_failed"][self.config_screen.current_lang].format(os.path.basename(path), error)
+        if self.stack.currentIndex() == 1:
+            self.viewer_screen.flash_message(text)
+        else:
+            self.result_screen.show_notice(text)
 
     def back_to_result(self):
         self.stack.setCurrentIndex(2)
@@ -1031,10 +3983,167 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         config_manager.config["window_size"] = [self.width(), self.height()]
         config_manager.save_config()
+        self.viewer_screen.stop_scan()
+        self.viewer_screen.file_mover.wait()
+        stats_manager.close()
         super().closeEvent(event)
 
+# --- シミュレーション (GUI なし) ---
+# 実際のライブラリに対して SessionEngine を早送りで何度も回し、
+# 選択の偏りと 1 回の画像切り替えにかかる時間を計測する
+class SimulatedClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+def parse_steps(text):
+    # "10x30,5x60" -> 30 秒 x 10 枚, 60 秒 x 5 枚 (枚数 0 は無限)
+    steps = []
+    for part in text.split(","):
+        count, duration = part.lower().split("x")
+        steps.append({"count": int(count), "duration": max(1, int(duration))})
+    return steps
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+def gini(values):
+    values = sorted(values)
+    total = sum(values)
+    if not values or total == 0:
+        return 0.0
+    weighted = sum((i + 1) * v for i, v in enumerate(values))
+    n = len(values)
+    return (2 * weighted) / (n * total) - (n + 1) / n
+
+def run_simulation(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="gesture_app.py simulate",
+                                     description="Replay sessions against an image library without the GUI.")
+    parser.add_argument("folders", nargs="+", help="image folders to include")
+    parser.add_argument("--steps", default="10x30,10x60,5x180", help="session steps as COUNTxSECONDS,... (count 0 = infinite)")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-rate", type=float, default=0.0, help="probability of skipping each image")
+    parser.add_argument("--infinite-limit", type=int, default=100, help="images per infinite step")
+    parser.add_argument("--prefetch-depth", type=int, default=config_manager.config.get("prefetch_depth", 3))
+    parser.add_argument("--from-stats", action="store_true", help="start from the saved view counts (never written back)")
+    parser.add_argument("--policy", choices=["min_count", "weighted"],
+                        default=config_manager.config.get("selection_policy", "min_count"))
+    args = parser.parse_args(argv)
+
+    steps = parse_steps(args.steps)
+    t = time.perf_counter()
+    paths = get_image_files([{"path": f, "checked": True} for f in args.folders])
+    scan_time = time.perf_counter() - t
+    if not paths:
+        print("No images found.", file=sys.stderr)
+        return 1
+
+    # 保存されない統計を使う。最後に表示した時刻もシミュレーション上の時計で進める
+    clock = SimulatedClock()
+    wall_start = time.time()
+    stats = ImageStatsManager(db_path=None, json_path=None, clock=lambda: wall_start + clock.now)
+    if args.from_stats:
+        stats_manager.ensure_loaded()
+        stats.stats = dict(stats_manager.stats)
+        stats.last_shown = dict(stats_manager.last_shown)
+        stats.flags = dict(stats_manager.flags)
+        stats.keys = dict(stats_manager.keys)
+    t = time.perf_counter()
+    pool = stats.create_pool(paths, args.policy, config_manager.config.get("selection_weights"))
+    pool_time = time.perf_counter() - t
+
+    rng = random.Random(args.seed)
+    transitions = []
+    shown = skipped = 0
+    t_start = time.perf_counter()
+    for _ in range(args.sessions):
+        engine = SessionEngine(steps, pool, stats, clock, rng.getrandbits(32))
+        infinite_shown = 0
+        while not engine.is_finished():
+            t = time.perf_counter()
+            path = engine.take_next()
+            if path is None:
+                break
+            engine.show(path)
+            engine.fill_upcoming(args.prefetch_depth)
+            elapsed = time.perf_counter() - t
+
+            if rng.random() < args.skip_rate:
+                clock.advance(rng.uniform(0, engine.duration))
+                t = time.perf_counter()
+                engine.skip_current()
+                transitions.append(elapsed + time.perf_counter() - t)
+                skipped += 1
+                continue
+
+            clock.advance(engine.remaining())
+            infinite = engine.step['count'] == 0
+            t = time.perf_counter()
+            engine.complete_current()
+            transitions.append(elapsed + time.perf_counter() - t)
+            shown += 1
+            if infinite:
+                infinite_shown += 1
+                if infinite_shown >= args.infinite_limit:
+                    break
+        engine.finish()
+    wall = time.perf_counter() - t_start
+
+    counts = [stats.get_count(p) for p in pool]
+    transitions.sort()
+    us = 1_000_000
+    mean_count = sum(counts) / len(counts)
+    stdev = math.sqrt(sum((c - mean_count) ** 2 for c in counts) / len(counts))
+    print(f"Library:      {len(paths)} images (scan {scan_time:.2f}s, pool build {pool_time * 1000:.1f}ms)")
+    print(f"Sessions:     {args.sessions}, shown {shown}, skipped {skipped}, simulated {clock.now / 3600:.1f}h")
+    print(f"Wall time:    {wall:.2f}s ({len(transitions) / wall if wall else 0:.0f} transitions/s)")
+    print("Transition:   mean {:.1f}us  p50 {:.1f}us  p95 {:.1f}us  p99 {:.1f}us  max {:.1f}us".format(
+        sum(transitions) / max(1, len(transitions)) * us, percentile(transitions, 0.5) * us,
+        percentile(transitions, 0.95) * us, percentile(transitions, 0.99) * us, (transitions[-1] if transitions else 0) * us))
+    print("Fairness:     views min {} / mean {:.2f} / max {}  spread {}  stdev {:.2f}  gini {:.3f}  coverage {:.1f}%".format(
+        min(counts), mean_count, max(counts), max(counts) - min(counts), stdev, gini(counts),
+        100.0 * sum(1 for c in counts if c > 0) / len(counts)))
+    return 0
+
+# --- 起動時間の計測 ---
+#   python gesture_app.py --startup-time
+# 最初の描画までと、統計の読み込み (バックグラウンド) が終わるまでの時間を表示して終了する
+def report_startup_time(app, window):
+    def wait_for_stats():
+        if not stats_manager.loaded:
+            QTimer.singleShot(5, wait_for_stats)
+            return
+        startup_times["stats"] = time.perf_counter() - STARTUP_T0
+        labels = [("imports", "Imports"), ("window", "Window built"), ("first_paint", "First paint"),
+                  ("presets", "Presets loaded"), ("stats", "Stats loaded")]
+        for key, label in labels:
+            print(f"{label + ':':<16}{startup_times[key] * 1000:>8.1f} ms")
+        print(f"{'':<16}{len(stats_manager.stats):>8} images with view counts")
+        app.quit()
+    window.first_painted.connect(wait_for_stats)
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["simulate"]:
+        sys.exit(run_simulation(sys.argv[2:]))
+
+    startup_report = "--startup-time" in sys.argv
+    if startup_report:
+        sys.argv.remove("--startup-time")
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(shutdown_thread_pools)
     window = MainWindow()
+    startup_times["window"] = time.perf_counter() - STARTUP_T0
+    if startup_report:
+        report_startup_time(app, window)
     window.show()
     sys.exit(app.exec())